@@ -0,0 +1,153 @@
+import argparse
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import sessionmaker
+
+from db_engine import create_inventory_engine
+from inv_manager import (
+    Base,
+    CapacityAudit,
+    Card,
+    Section,
+    SectionChange,
+    ensure_rollups,
+    logger,
+    recompute_rollups,
+    record_section_changes,
+)
+
+
+def section_drift(session, section_filter=None):
+    """
+    Sections whose card_count or current_quantity differ from the sum of
+    their cards' quantities, as (section_id, card_count, current_quantity,
+    actual) tuples. The true totals come from one GROUP BY pass over cards.
+    """
+    actual = select(
+        Card.section_id.label("section_id"),
+        func.sum(Card.quantity).label("quantity"),
+    ).group_by(Card.section_id)
+    if section_filter is not None:
+        actual = actual.where(Card.section_id.in_(section_filter))
+    actual = actual.subquery()
+    quantity = func.coalesce(actual.c.quantity, 0)
+
+    statement = (
+        select(Section.id, Section.card_count, Section.current_quantity, quantity)
+        .outerjoin(actual, actual.c.section_id == Section.id)
+        .where(
+            or_(
+                Section.card_count != quantity,
+                Section.current_quantity != quantity,
+            )
+        )
+        .order_by(Section.id)
+    )
+    if section_filter is not None:
+        statement = statement.where(Section.id.in_(section_filter))
+    return [tuple(row) for row in session.execute(statement)]
+
+
+def repair_drift(session, section_ids):
+    """
+    Reset card_count and current_quantity of section_ids to their cards'
+    total with one set-based UPDATE, then rebuild the rollups. The caller
+    commits.
+    """
+    if not section_ids:
+        return
+    sections = Section.__table__
+    actual = (
+        select(func.coalesce(func.sum(Card.quantity), 0))
+        .where(Card.section_id == sections.c.id)
+        .scalar_subquery()
+    )
+    session.execute(
+        sections.update()
+        .where(sections.c.id.in_(section_ids))
+        .values(card_count=actual, current_quantity=actual)
+    )
+    record_section_changes(session, section_ids)
+    recompute_rollups(session)
+
+
+def audit_capacity(session, incremental=False, repair=False):
+    """
+    Compare section counters with the cards they hold and record the run
+    in capacity_audits. With incremental=True only sections changed since
+    the last audit that left no drift behind are checked (a full audit runs
+    if there is none yet), so unrepaired drift is reported again.
+    With repair=True drifted sections are corrected in the same commit.
+    Returns the CapacityAudit and the drift tuples from section_drift.
+    """
+    last_change_id = session.query(func.max(SectionChange.id)).scalar() or 0
+    previous = None
+    if incremental:
+        previous = (
+            session.query(CapacityAudit)
+            .filter(or_(CapacityAudit.drifted == 0, CapacityAudit.repaired))
+            .order_by(CapacityAudit.id.desc())
+            .first()
+        )
+
+    section_filter = None
+    if previous is not None:
+        section_filter = (
+            select(SectionChange.section_id)
+            .where(
+                SectionChange.id > previous.last_change_id,
+                SectionChange.id <= last_change_id,
+            )
+            .distinct()
+        )
+        checked = session.execute(
+            select(func.count()).select_from(section_filter.subquery())
+        ).scalar()
+    else:
+        checked = session.query(func.count(Section.id)).scalar()
+
+    drift = section_drift(session, section_filter)
+    for section_id, card_count, current_quantity, actual in drift:
+        logger.warning(
+            f"Section {section_id}: card_count {card_count}, "
+            f"current_quantity {current_quantity}, cards hold {actual}"
+        )
+    if repair:
+        repair_drift(session, [section_id for section_id, _, _, _ in drift])
+
+    audit = CapacityAudit(
+        last_change_id=last_change_id,
+        incremental=previous is not None,
+        sections_checked=checked,
+        drifted=len(drift),
+        repaired=repair and bool(drift),
+    )
+    session.add(audit)
+    session.commit()
+    logger.info(
+        f"Audited {checked} sections: {len(drift)} drifted"
+        + (", repaired" if audit.repaired else "")
+    )
+    return audit, drift
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check section capacity counters against the cards they hold"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only check sections changed since the last audit",
+    )
+    parser.add_argument(
+        "--repair", action="store_true", help="reset drifted counters to the card totals"
+    )
+    args = parser.parse_args()
+
+    engine = create_inventory_engine()
+    Base.metadata.create_all(engine)
+    ensure_rollups(engine)
+    session = sessionmaker(bind=engine)()
+
+    audit_capacity(session, incremental=args.incremental, repair=args.repair)
@@ -0,0 +1,47 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+import inv_manager
+from db_engine import SQLITE_PROFILES, create_inventory_engine
+
+
+def benchmark_profile(profile, cards, directory):
+    """
+    Insert `cards` single-card transactions through insert_card and
+    return the throughput in cards per second.
+    """
+    path = os.path.join(directory, f"{profile}.db")
+    engine = create_inventory_engine(f"sqlite:///{path}", profile=profile)
+    inv_manager.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    inventory_status = inv_manager.InventoryStatus()
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tcg_id in range(cards):
+            inv_manager.insert_card(
+                session, inventory_status, tcg_id, f"Card {tcg_id}", "Benchmark", 1
+            )
+    elapsed = time.perf_counter() - started
+
+    session.close()
+    engine.dispose()
+    return cards / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare insert throughput per SQLite profile")
+    parser.add_argument("--cards", type=int, default=2000)
+    args = parser.parse_args()
+
+    inv_manager.logger.setLevel("WARNING")
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in SQLITE_PROFILES:
+            rate = benchmark_profile(profile, args.cards, directory)
+            print(f"{profile}: {rate:.0f} cards/sec")
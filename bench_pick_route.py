@@ -0,0 +1,48 @@
+import argparse
+import random
+import time
+
+from mtg_inventory_system import (
+    aisle_cost, box_position, order_pick_route, parse_location, route_cost)
+
+
+def synthetic_wave(lines, boxes, seed=0):
+    rng = random.Random(seed)
+    stops = []
+    for tcg_id in range(lines):
+        box_id = rng.randint(1, boxes)
+        row_id = (box_id - 1) * 5 + rng.randint(1, 5)
+        section_id = (row_id - 1) * 10 + rng.randint(1, 10)
+        stops.append({'TCGplayer Id': tcg_id, 'Location': f"{box_id}.{row_id}.{section_id}"})
+    return stops
+
+
+def benchmark_route(lines=5000, boxes=400, repeat=5):
+    """
+    Time route ordering for a synthetic pick wave and compare walking cost with file order.
+    """
+    stops = synthetic_wave(lines, boxes)
+
+    def positions(route):
+        return [box_position(parse_location(stop['Location'])[0]) for stop in route]
+
+    results = {'lines': lines, 'file_order_cost': route_cost(positions(stops))}
+    for name, cost_model in (('serpentine', None), ('nearest', aisle_cost)):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            route = order_pick_route(stops, cost_model)
+            best = min(best, time.perf_counter() - started)
+        results[f"{name}_ms"] = best * 1000
+        results[f"{name}_cost"] = route_cost(positions(route))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pick route ordering")
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--boxes", type=int, default=400)
+    args = parser.parse_args()
+
+    for key, value in benchmark_route(args.lines, args.boxes).items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
@@ -0,0 +1,165 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+import inv_manager
+from db_engine import create_inventory_engine
+from inv_manager import (
+    Base,
+    Box,
+    InventoryStatus,
+    Section,
+    bulk_insert_records,
+    insert_card,
+    parse_csv_rows,
+    remove_quantities,
+    resolve_pick_list,
+)
+from placement import PLACEMENT_STRATEGIES
+
+
+class TimedStrategy:
+    """
+    Wraps a placement strategy and records how long each choose() takes.
+    """
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.timings = []
+
+    def choose(self, index, quantity, set_name=None):
+        started = time.perf_counter()
+        section_id = self.strategy.choose(index, quantity, set_name)
+        self.timings.append(time.perf_counter() - started)
+        return section_id
+
+    def __getattr__(self, name):
+        return getattr(self.strategy, name)
+
+
+def intake_stream(records, passes, seed=0):
+    """
+    The CSV's records replayed `passes` times, each pass shuffled, as
+    repeated intake of the same catalogue would arrive at the counter.
+    """
+    rng = random.Random(seed)
+    stream = []
+    for _ in range(passes):
+        batch = list(records)
+        rng.shuffle(batch)
+        stream.extend(batch)
+    return stream
+
+
+def simulate(strategy, stream, directory, pick_fraction=0.0, bulk=False, seed=0):
+    """
+    Load stream into a fresh database with one placement strategy, picking
+    pick_fraction of the SKUs after each quarter to fragment the sections.
+    Returns fill ratio, boxes opened and allocation latency.
+    """
+    path = os.path.join(directory, f"placement-{strategy}.db")
+    engine = create_inventory_engine(f"sqlite:///{path}", profile="bulk-load")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    inventory_status = InventoryStatus(placement=strategy)
+    timed = TimedStrategy(inventory_status.placement)
+    inventory_status.placement = timed
+    rng = random.Random(seed)
+
+    started = time.perf_counter()
+    quarter = max(1, len(stream) // 4)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for start in range(0, len(stream), quarter):
+            chunk = stream[start : start + quarter]
+            if bulk:
+                bulk_insert_records(session, inventory_status, chunk)
+            else:
+                for record in chunk:
+                    insert_card(session, inventory_status, *record)
+            if pick_fraction:
+                skus = sorted({record[0] for record in chunk})
+                order_lines = [
+                    (tcg_id, rng.randint(1, 4))
+                    for tcg_id in rng.sample(skus, int(len(skus) * pick_fraction))
+                ]
+                picks = resolve_pick_list(session, order_lines)
+                remove_quantities(
+                    session, inventory_status, [pick for line in picks for pick in line]
+                )
+    elapsed = time.perf_counter() - started
+
+    boxes = session.execute(select(func.count(Box.id))).scalar()
+    stored, capacity, used = session.execute(
+        select(
+            func.coalesce(func.sum(Section.card_count), 0),
+            func.coalesce(func.sum(Section.max_cards), 0),
+            func.count(Section.id).filter(Section.card_count > 0),
+        )
+    ).one()
+    session.close()
+    engine.dispose()
+
+    timings = sorted(timed.timings) or [0.0]
+    return {
+        "strategy": strategy,
+        "records": len(stream),
+        "boxes": boxes,
+        "sections_used": used,
+        "fill_ratio": stored / capacity if capacity else 0.0,
+        "used_section_fill": stored / (used * inv_manager.SECTION_CAPACITY) if used else 0.0,
+        "choose_mean_us": sum(timings) / len(timings) * 1e6,
+        "choose_p99_us": timings[int(len(timings) * 0.99)] * 1e6,
+        "seconds": elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay an intake stream under each placement strategy"
+    )
+    parser.add_argument("filepath", nargs="?", default="roca-test-3.csv")
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=sorted(PLACEMENT_STRATEGIES),
+        default=sorted(PLACEMENT_STRATEGIES),
+    )
+    parser.add_argument("--passes", type=int, default=4, help="times the CSV is replayed")
+    parser.add_argument(
+        "--pick-fraction",
+        type=float,
+        default=0.25,
+        help="share of SKUs picked after each quarter of the stream",
+    )
+    parser.add_argument("--bulk", action="store_true", help="load with bulk_insert_records")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    inv_manager.logger.setLevel("ERROR")
+    stream = intake_stream(parse_csv_rows(args.filepath), args.passes)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for strategy in args.strategies:
+            results.append(
+                simulate(strategy, stream, directory, args.pick_fraction, args.bulk)
+            )
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for result in results:
+            print(
+                f"{result['strategy']:>13}: {result['boxes']} boxes, "
+                f"fill {result['fill_ratio']:.1%} "
+                f"({result['used_section_fill']:.1%} of used sections), "
+                f"choose {result['choose_mean_us']:.1f}us mean / "
+                f"{result['choose_p99_us']:.1f}us p99, {result['seconds']:.2f}s"
+            )
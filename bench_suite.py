@@ -0,0 +1,328 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+
+import inv_manager
+import mtg_inventory_system
+from db_engine import SQLITE_PROFILES, create_inventory_engine
+from inv_manager import (
+    Base,
+    InventoryStatus,
+    bulk_upload_from_csv,
+    choose_section,
+    generate_inventory,
+    parse_card_row,
+    parse_csv_rows,
+    remove_quantities,
+    resolve_pick_list,
+    upload_from_csv,
+)
+from metrics import metrics
+from synthetic_csv import QUANTITIES, write_synthetic_csv
+
+DEFAULT_SCALES = [1000, 10000, 100000]
+PER_ROW_LIMIT = 20000
+ALLOCATION_SAMPLES = 10000
+FIXTURE_CHUNK = 50000
+
+
+def _timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def _engine(directory, name, profile, database_url=None):
+    """
+    A fresh database for one stage: a new SQLite file in directory, or the
+    server at database_url with every inventory table dropped.
+    """
+    if database_url is None:
+        engine = create_inventory_engine(
+            f"sqlite:///{os.path.join(directory, name)}", profile=profile
+        )
+    else:
+        engine = create_inventory_engine(database_url)
+        Base.metadata.drop_all(engine)
+        mtg_inventory_system.Base.metadata.drop_all(engine)
+    return engine, sessionmaker(bind=engine)()
+
+
+def iter_records(filepath):
+    with open(filepath, newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                yield parse_card_row(row)
+            except ValueError:
+                continue
+
+
+def load_mtg_fixture(session, records):
+    """
+    Shelve records into mtg_inventory_system's schema with Core inserts,
+    filling each section up to its max_card_quantity in file order.
+    Cards are written FIXTURE_CHUNK at a time.
+    """
+    tables = mtg_inventory_system.Base.metadata.tables
+    max_quantity = mtg_inventory_system.Section.max_card_quantity.default.arg
+    sections = []
+    cards = []
+    for tcg_id, card_name, set_name, quantity in records:
+        if not sections or sections[-1]["current_quantity"] + quantity > max_quantity:
+            section_id = len(sections) + 1
+            sections.append(
+                {
+                    "id": section_id,
+                    "row_id": (section_id - 1) // 10 + 1,
+                    "card_count": 0,
+                    "current_quantity": 0,
+                    "max_card_quantity": max_quantity,
+                }
+            )
+        section = sections[-1]
+        section["card_count"] += 1
+        section["current_quantity"] += quantity
+        cards.append(
+            {
+                "section_id": section["id"],
+                "tcg_id": tcg_id,
+                "card_name": card_name,
+                "set_name": set_name,
+                "quantity": quantity,
+            }
+        )
+        if len(cards) >= FIXTURE_CHUNK:
+            session.execute(tables["cards"].insert(), cards)
+            cards = []
+    row_count = (len(sections) + 9) // 10
+    box_count = (row_count + 4) // 5
+    session.execute(
+        tables["boxes"].insert(),
+        [{"id": box_id, "row_count": 5, "max_rows": 5} for box_id in range(1, box_count + 1)],
+    )
+    session.execute(
+        tables["rows"].insert(),
+        [
+            {"id": row_id, "box_id": (row_id - 1) // 5 + 1, "section_count": 10}
+            for row_id in range(1, row_count + 1)
+        ],
+    )
+    if sections:
+        session.execute(tables["sections"].insert(), sections)
+    if cards:
+        session.execute(tables["cards"].insert(), cards)
+    session.commit()
+
+
+def time_allocation(session, samples=ALLOCATION_SAMPLES, seed=0):
+    """
+    Time building the free-space index from the loaded database, then
+    choose_section for `samples` random quantities. Nothing is committed.
+    """
+    rng = random.Random(seed)
+    inventory_status = InventoryStatus()
+    index_seconds, _ = _timed(inventory_status.free_space_index, session)
+    quantities = rng.choices(QUANTITIES, k=samples)
+    started = time.perf_counter()
+    for quantity in quantities:
+        choose_section(session, inventory_status, quantity)
+    choose_seconds = time.perf_counter() - started
+    session.rollback()
+    return index_seconds, choose_seconds / samples
+
+
+def run_scale(rows, directory, skew, seed, profile, per_row_limit, database_url=None):
+    """
+    Generate one synthetic export and time each workload against it, on
+    SQLite files or on the server at database_url. Returns a dict of
+    timings in seconds (None where a stage was skipped).
+    """
+    csv_path = os.path.join(directory, f"intake-{rows}.csv")
+    order_path = os.path.join(directory, f"order-{rows}.csv")
+    timings = {}
+    timings["generate_csv"], _ = _timed(
+        write_synthetic_csv, csv_path, rows, skew=skew, seed=seed
+    )
+    order_rows = max(rows // 10, 1)
+    write_synthetic_csv(order_path, order_rows, skus=max(rows // 4, 1), skew=skew, seed=seed + 1)
+
+    timings["upload_from_csv"] = None
+    if rows <= per_row_limit:
+        engine, session = _engine(directory, f"per-row-{rows}.db", profile, database_url)
+        Base.metadata.create_all(engine)
+        timings["upload_from_csv"], _ = _timed(
+            upload_from_csv, csv_path, session, InventoryStatus()
+        )
+        session.close()
+        engine.dispose()
+
+    engine, session = _engine(directory, f"bulk-{rows}.db", profile, database_url)
+    Base.metadata.create_all(engine)
+    timings["bulk_upload_from_csv"], _ = _timed(
+        bulk_upload_from_csv, csv_path, session, InventoryStatus()
+    )
+    timings["generate_inventory"], _ = _timed(
+        generate_inventory, session, os.path.join(directory, f"inventory-{rows}.json")
+    )
+    timings["free_space_index_build"], timings["choose_section_mean"] = time_allocation(
+        session, seed=seed
+    )
+    order_lines = [
+        (tcg_id, quantity) for tcg_id, _, _, quantity in parse_csv_rows(order_path)
+    ]
+    timings["resolve_pick_list"], picks = _timed(resolve_pick_list, session, order_lines)
+    timings["remove_quantities"], _ = _timed(
+        remove_quantities,
+        session,
+        InventoryStatus(),
+        [pick for line in picks for pick in line],
+    )
+    session.close()
+    engine.dispose()
+
+    engine, session = _engine(directory, f"mtg-{rows}.db", profile, database_url)
+    mtg_inventory_system.Base.metadata.create_all(engine)
+    load_mtg_fixture(session, iter_records(csv_path))
+    timings["match_order_from_csv"], _ = _timed(
+        mtg_inventory_system.match_order_from_csv, order_path, session
+    )
+    session.close()
+    engine.dispose()
+
+    with open(csv_path, newline="") as f:
+        valid_rows = sum(1 for row in csv.DictReader(f) if row["TCGplayer Id"].isdigit())
+    return {"rows": rows, "valid_rows": valid_rows, "order_rows": order_rows, "seconds": timings}
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(
+    scales,
+    skew=1.1,
+    seed=0,
+    profile="interactive",
+    per_row_limit=PER_ROW_LIMIT,
+    postgres_url=None,
+):
+    """
+    Run every scale in a temporary directory and return one result record
+    per scale and backend, tagged with the commit and environment it ran
+    on. With postgres_url each scale also runs against that server, whose
+    inventory tables are dropped and recreated.
+    """
+    backends = [("sqlite", None)]
+    if postgres_url:
+        backends.append(("postgresql", postgres_url))
+    environment = {
+        "commit": current_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "profile": profile,
+        "skew": skew,
+        "seed": seed,
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows, (backend, database_url) in itertools.product(scales, backends):
+            result = {
+                **environment,
+                "backend": backend,
+                **run_scale(
+                    rows, directory, skew, seed, profile, per_row_limit, database_url
+                ),
+            }
+            results.append(result)
+            print(
+                f"{rows} rows on {backend}: "
+                + ", ".join(
+                    f"{name} {seconds:.3g}s"
+                    for name, seconds in result["seconds"].items()
+                    if seconds is not None
+                )
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time intake, export, allocation and picking on synthetic exports"
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SCALES,
+        help="export sizes to run (1000 up to 10000000)",
+    )
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--profile", choices=sorted(SQLITE_PROFILES), default="interactive"
+    )
+    parser.add_argument(
+        "--per-row-limit",
+        type=int,
+        default=PER_ROW_LIMIT,
+        help="skip the per-row upload_from_csv above this many rows",
+    )
+    parser.add_argument(
+        "--postgres-url",
+        default=None,
+        help="also run every scale against this PostgreSQL database; "
+        "its inventory tables are dropped",
+    )
+    parser.add_argument(
+        "--output",
+        default="bench_results.jsonl",
+        help="JSON-lines file that each run's records are appended to",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="also record per-stage timings and write them to PATH (.prom or JSON)",
+    )
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+
+    inv_manager.logger.setLevel("ERROR")
+    mtg_inventory_system.logger.setLevel("ERROR")
+    results = run_suite(
+        args.rows,
+        args.skew,
+        args.seed,
+        args.profile,
+        args.per_row_limit,
+        args.postgres_url,
+    )
+    with open(args.output, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    if args.metrics:
+        metrics.write(args.metrics)
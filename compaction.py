@@ -0,0 +1,230 @@
+import argparse
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import sessionmaker
+
+from db_engine import create_inventory_engine
+from free_space import FreeSpaceIndex
+from inv_manager import (
+    EVENT_MOVE,
+    Base,
+    Card,
+    InventoryStatus,
+    Row,
+    Section,
+    apply_capacity_deltas,
+    card_event,
+    ensure_event_log,
+    ensure_rollups,
+    logger,
+    record_events,
+    record_section_changes,
+)
+
+DEFAULT_MAX_MOVES = 200
+
+
+class CompactionPlan:
+    """
+    Output of plan_compaction: card moves as (card_id, tcg_id, from_section,
+    to_section, quantity) tuples, the boxes they empty, and each section's
+    "box.row.section" location for printing the move list.
+    """
+
+    def __init__(self, locations):
+        self.moves = []
+        self.emptied_boxes = []
+        self.locations = locations
+
+    def describe(self):
+        return [
+            f"{tcg_id} x{quantity}: {self.locations[from_section]} -> {self.locations[to_section]}"
+            for _, tcg_id, from_section, to_section, quantity in self.moves
+        ]
+
+
+def plan_compaction(session, max_moves=DEFAULT_MAX_MOVES):
+    """
+    Propose moves that empty whole boxes, emptiest first, into the free
+    space of fuller boxes. Each card is moved whole into the tightest
+    section that holds it (best-fit, largest cards first). A box is only
+    planned if all of its cards fit and the move count stays within
+    max_moves; boxes that receive cards are never emptied afterwards.
+    """
+    boxes = {}
+    section_boxes = {}
+    locations = {}
+    counters = {}
+    for section_id, box_id, row_id, card_count, max_cards in session.execute(
+        select(Section.id, Row.box_id, Section.row_id, Section.card_count, Section.max_cards)
+        .join(Row, Section.row_id == Row.id)
+        .order_by(Section.id)
+    ):
+        card_count = card_count or 0
+        boxes.setdefault(box_id, []).append(section_id)
+        section_boxes[section_id] = box_id
+        locations[section_id] = f"{box_id}.{row_id}.{section_id}"
+        counters[section_id] = (card_count, max_cards)
+
+    stored = {
+        box_id: sum(counters[section_id][0] for section_id in section_ids)
+        for box_id, section_ids in boxes.items()
+    }
+    occupied = [box_id for box_id in boxes if stored[box_id] > 0]
+    index = FreeSpaceIndex.from_rows(
+        (section_id, *counters[section_id])
+        for box_id in occupied
+        for section_id in boxes[box_id]
+    )
+    free_total = index.free_capacity()
+
+    plan = CompactionPlan(locations)
+    receivers = set()
+    for box_id in sorted(occupied, key=lambda box_id: (stored[box_id], -box_id)):
+        budget = max_moves - len(plan.moves)
+        if budget <= 0:
+            break
+        if box_id in receivers:
+            continue
+        section_ids = boxes[box_id]
+        box_free = sum(index.remaining(section_id) for section_id in section_ids)
+        if stored[box_id] > free_total - box_free:
+            break
+
+        cards = session.execute(
+            select(Card.id, Card.tcg_id, Card.section_id, Card.quantity)
+            .where(Card.section_id.in_(section_ids), Card.quantity > 0)
+            .order_by(Card.quantity.desc(), Card.id)
+        ).all()
+        if len(cards) > budget:
+            continue
+
+        for section_id in section_ids:
+            index.discard(section_id)
+        previous = []
+        moves = []
+        for card_id, tcg_id, section_id, quantity in cards:
+            target = index.find_best(quantity)
+            if target is None:
+                break
+            card_count, max_cards = index.counts(target)
+            previous.append((target, card_count, max_cards))
+            index.update(target, card_count + quantity, max_cards)
+            moves.append((card_id, tcg_id, section_id, target, quantity))
+        else:
+            plan.moves.extend(moves)
+            plan.emptied_boxes.append(box_id)
+            receivers.update(section_boxes[move[3]] for move in moves)
+            free_total -= box_free + stored[box_id]
+            continue
+
+        for target, card_count, max_cards in reversed(previous):
+            index.update(target, card_count, max_cards)
+        for section_id in section_ids:
+            index.update(section_id, *counters[section_id])
+
+    return plan
+
+
+def execute_compaction(session, inventory_status, plan):
+    """
+    Apply a CompactionPlan as one transaction of executemany statements,
+    cards first and then sections, in the lock order inv_manager's write
+    paths use. Each card only moves if it is still where the plan found
+    it and target sections are reserved conditionally, so a plan made
+    stale by concurrent picks or intake is rolled back and False returned.
+    """
+    if not plan.moves:
+        return True
+    cards, sections = Card.__table__, Section.__table__
+    deltas = {}
+    for _, _, from_section, to_section, quantity in plan.moves:
+        deltas[from_section] = deltas.get(from_section, 0) - quantity
+        deltas[to_section] = deltas.get(to_section, 0) + quantity
+    deltas = {section_id: added for section_id, added in deltas.items() if added}
+
+    try:
+        result = session.execute(
+            cards.update()
+            .where(
+                cards.c.id == bindparam("_id"),
+                cards.c.section_id == bindparam("_from"),
+                cards.c.quantity == bindparam("_quantity"),
+            )
+            .values(section_id=bindparam("_to")),
+            [
+                {"_id": card_id, "_from": from_section, "_to": to_section, "_quantity": quantity}
+                for card_id, _, from_section, to_section, quantity in sorted(plan.moves)
+            ],
+        )
+        if result.rowcount != len(plan.moves):
+            session.rollback()
+            return False
+
+        # Sections that lose cards always pass the capacity check.
+        result = session.execute(
+            sections.update()
+            .where(
+                sections.c.id == bindparam("_id"),
+                sections.c.card_count + bindparam("_added") <= sections.c.max_cards,
+            )
+            .values(
+                card_count=sections.c.card_count + bindparam("_added"),
+                current_quantity=sections.c.current_quantity + bindparam("_added"),
+            ),
+            [{"_id": section_id, "_added": added} for section_id, added in sorted(deltas.items())],
+        )
+        if result.rowcount != len(deltas):
+            session.rollback()
+            return False
+
+        apply_capacity_deltas(session, deltas)
+        record_section_changes(session, list(deltas))
+        record_events(
+            session,
+            [
+                card_event(EVENT_MOVE, card_id, 0, tcg_id, to_section, from_section)
+                for card_id, tcg_id, from_section, to_section, _ in plan.moves
+            ],
+        )
+        session.commit()
+    except Exception as e:
+        logger.error(f"Failed to commit session: {e}")
+        session.rollback()
+        inventory_status.reset_caches()
+        raise
+
+    inventory_status.reset_caches()
+    logger.info(
+        f"Moved {len(plan.moves)} cards, emptying boxes {plan.emptied_boxes}"
+    )
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Consolidate sparse sections into fewer boxes"
+    )
+    parser.add_argument(
+        "--max-moves",
+        type=int,
+        default=DEFAULT_MAX_MOVES,
+        help="cap on physical card moves per run",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the moves without applying them"
+    )
+    args = parser.parse_args()
+
+    engine = create_inventory_engine()
+    Base.metadata.create_all(engine)
+    ensure_rollups(engine)
+    ensure_event_log(engine)
+    session = sessionmaker(bind=engine)()
+
+    plan = plan_compaction(session, args.max_moves)
+    for line in plan.describe():
+        print(line)
+    print(f"{len(plan.moves)} moves empty boxes {plan.emptied_boxes}")
+    if not args.dry_run and not execute_compaction(session, InventoryStatus(), plan):
+        logger.warning("Inventory changed while planning; nothing was moved")
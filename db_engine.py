@@ -0,0 +1,191 @@
+import csv
+import io
+import os
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URL = "sqlite:///mtg_inventory.db"
+DATABASE_URL_ENV = "INVENTORY_DATABASE_URL"
+
+# Drivers that only work on one side; database_url swaps them for the
+# driver of the same backend that works on the other.
+SYNC_DRIVERS = {"sqlite": "sqlite", "postgresql": "postgresql+psycopg"}
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+psycopg"}
+SYNC_ONLY_DRIVERS = {"default", "pysqlite", "psycopg2"}
+ASYNC_ONLY_DRIVERS = {"aiosqlite", "asyncpg"}
+
+# Connection pool for server databases (SQLite keeps SQLAlchemy's own),
+# each overridable with INVENTORY_<NAME> in the environment.
+POOL_SETTINGS = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+}
+
+# PRAGMAs applied to every new SQLite connection, per profile.
+# cache_size is negative KiB; mmap_size is bytes. busy_timeout (ms) lets
+# concurrent intake stations wait for the write lock instead of failing.
+SQLITE_PROFILES = {
+    # Large intake runs that can simply be re-run after a power loss.
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -262144,
+        "mmap_size": 1073741824,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+    # Day-to-day counter work: durable at checkpoints, no fsync per commit.
+    "interactive": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+    # SQLite defaults: rollback journal with an fsync on every commit.
+    "safe": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 30000,
+    },
+}
+
+
+def apply_sqlite_profile(engine, profile="interactive", **pragmas):
+    """
+    Register a connect hook that applies the named profile's PRAGMAs
+    (overridden by any keyword pragmas) to each new SQLite connection.
+    """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(
+            f"Unknown profile {profile!r}; expected one of {sorted(SQLITE_PROFILES)}"
+        )
+    settings = {**SQLITE_PROFILES[profile], **pragmas}
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def database_url(url=None, asynchronous=False):
+    """
+    url, else INVENTORY_DATABASE_URL, else the local SQLite file, with an
+    async-only driver swapped for a sync one (or the reverse when
+    asynchronous), so one setting serves the CLIs and the service.
+    """
+    url = make_url(url or os.environ.get(DATABASE_URL_ENV, DEFAULT_DATABASE_URL))
+    # No explicit driver means SQLAlchemy's default, which is sync-only.
+    driver = url.drivername.partition("+")[2] or "default"
+    unusable = SYNC_ONLY_DRIVERS if asynchronous else ASYNC_ONLY_DRIVERS
+    if driver in unusable:
+        drivers = ASYNC_DRIVERS if asynchronous else SYNC_DRIVERS
+        url = url.set(drivername=drivers[url.get_backend_name()])
+    return url
+
+
+def pool_settings(**overrides):
+    settings = {
+        name: int(os.environ.get(f"INVENTORY_{name.upper()}", default))
+        for name, default in POOL_SETTINGS.items()
+    }
+    settings.update(
+        (name, value) for name, value in overrides.items() if value is not None
+    )
+    return {**settings, "pool_pre_ping": True}
+
+
+def create_inventory_engine(url=None, profile="interactive", pool=None, **pragmas):
+    """
+    create_engine for the inventory database (see database_url). SQLite
+    URLs get the PRAGMA profile; server URLs get the pool settings, with
+    `pool` overriding individual ones.
+    """
+    url = database_url(url)
+    if url.get_backend_name() == "sqlite":
+        engine = create_engine(url)
+        apply_sqlite_profile(engine, profile, **pragmas)
+    else:
+        engine = create_engine(url, **pool_settings(**(pool or {})))
+    return engine
+
+
+def is_postgresql(bind):
+    """
+    True if bind (an Engine, Connection or Session) talks to PostgreSQL.
+    """
+    dialect = getattr(bind, "dialect", None) or bind.get_bind().dialect
+    return dialect.name == "postgresql"
+
+
+def reserve_ids(bind, table, count):
+    """
+    Draw count ids from the PostgreSQL sequence behind table.id, so rows
+    can be loaded with known ids while other stations insert concurrently.
+    """
+    return (
+        bind.execute(
+            text(
+                "SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                "FROM generate_series(1, :count)"
+            ),
+            {"table": table.name, "count": count},
+        )
+        .scalars()
+        .all()
+    )
+
+
+def copy_rows(session, table, rows):
+    """
+    Load rows (dicts) into table with PostgreSQL COPY FROM STDIN inside the
+    session's transaction. COPY bypasses SQLAlchemy, so columns missing
+    from the rows are filled with their scalar Python defaults.
+    """
+    if not rows:
+        return
+    names = list(rows[0])
+    defaults = {
+        column.name: column.default.arg
+        for column in table.columns
+        if column.name not in names
+        and column.default is not None
+        and column.default.is_scalar
+    }
+    names.extend(defaults)
+    connection = session.connection()
+    preparer = connection.dialect.identifier_preparer
+    statement = (
+        f"COPY {preparer.format_table(table)} "
+        f"({', '.join(preparer.quote(name) for name in names)}) FROM STDIN"
+    )
+    dbapi_connection = connection.connection.driver_connection
+    with dbapi_connection.cursor() as cursor:
+        if hasattr(cursor, "copy"):
+            # psycopg 3
+            with cursor.copy(statement) as copy:
+                for row in rows:
+                    copy.write_row([row.get(name, defaults.get(name)) for name in names])
+        else:
+            # psycopg2
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(
+                    [
+                        "\\N" if value is None else value
+                        for value in (row.get(name, defaults.get(name)) for name in names)
+                    ]
+                )
+            buffer.seek(0)
+            cursor.copy_expert(f"{statement} WITH (FORMAT csv, NULL '\\N')", buffer)
+
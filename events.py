@@ -0,0 +1,254 @@
+import argparse
+import csv
+import os
+import time
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.orm import sessionmaker
+
+from db_engine import create_inventory_engine
+from inv_manager import (
+    EVENT_MOVE,
+    Base,
+    Card,
+    EventSnapshot,
+    InventoryEvent,
+    Section,
+    ensure_event_log,
+    logger,
+    recompute_rollups,
+    record_section_changes,
+)
+
+EVENT_SNAPSHOT_DIR = "event_snapshots"
+REPLAY_BATCH = 10000
+SNAPSHOT_EVERY = 100000
+SNAPSHOT_FIELDS = ["card_id", "tcg_id", "card_name", "set_name", "section_id", "quantity"]
+
+
+def latest_snapshot(session, upto=None):
+    query = session.query(EventSnapshot)
+    if upto is not None:
+        query = query.filter(EventSnapshot.last_event_id <= upto)
+    return query.order_by(EventSnapshot.last_event_id.desc()).first()
+
+
+def load_snapshot_state(path):
+    """
+    card_id -> [tcg_id, card_name, set_name, section_id, quantity] from a
+    materialized snapshot file.
+    """
+    state = {}
+    with open(path, newline="") as f:
+        for card_id, tcg_id, card_name, set_name, section_id, quantity in csv.reader(f):
+            state[int(card_id)] = [
+                int(tcg_id),
+                card_name,
+                set_name,
+                int(section_id) if section_id else None,
+                int(quantity),
+            ]
+    return state
+
+
+def apply_events(state, events):
+    """
+    Fold (kind, card_id, tcg_id, section_id, quantity, card_name, set_name)
+    event rows into state, in order.
+    """
+    for kind, card_id, tcg_id, section_id, quantity, card_name, set_name in events:
+        card = state.get(card_id)
+        if kind == EVENT_MOVE:
+            if card is not None:
+                card[3] = section_id
+        elif card is None:
+            if quantity > 0:
+                state[card_id] = [tcg_id, card_name, set_name, section_id, quantity]
+        else:
+            card[4] += quantity
+            if card[4] <= 0:
+                del state[card_id]
+
+
+def replay_state(session, upto=None, batch_size=REPLAY_BATCH):
+    """
+    Rebuild the card state as of event `upto` (default: the latest) from
+    the nearest materialized snapshot plus the events after it, streamed
+    batch_size rows at a time. Returns (state, last_event_id).
+    """
+    snapshot = latest_snapshot(session, upto)
+    if snapshot is not None:
+        state = load_snapshot_state(snapshot.path)
+        last_event_id = snapshot.last_event_id
+    else:
+        state = {}
+        last_event_id = 0
+
+    statement = (
+        select(
+            InventoryEvent.id,
+            InventoryEvent.kind,
+            InventoryEvent.card_id,
+            InventoryEvent.tcg_id,
+            InventoryEvent.section_id,
+            InventoryEvent.quantity,
+            InventoryEvent.card_name,
+            InventoryEvent.set_name,
+        )
+        .where(InventoryEvent.id > last_event_id)
+        .order_by(InventoryEvent.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if upto is not None:
+        statement = statement.where(InventoryEvent.id <= upto)
+    for batch in session.execute(statement).partitions():
+        apply_events(state, (event[1:] for event in batch))
+        last_event_id = batch[-1][0]
+    return state, last_event_id
+
+
+def write_event_snapshot(session, directory=EVENT_SNAPSHOT_DIR):
+    """
+    Materialize the replayed card state to a CSV file and record it.
+    """
+    started = time.perf_counter()
+    state, last_event_id = replay_state(session)
+    snapshot = EventSnapshot(last_event_id=last_event_id, card_rows=len(state))
+    session.add(snapshot)
+    session.flush()
+    os.makedirs(directory, exist_ok=True)
+    snapshot.path = os.path.join(directory, f"events-{snapshot.id}.csv")
+    with open(snapshot.path, "w", newline="") as f:
+        writer = csv.writer(f)
+        for card_id in sorted(state):
+            writer.writerow([card_id, *state[card_id]])
+    session.commit()
+    logger.info(
+        f"Materialized {len(state)} cards at event {last_event_id} to {snapshot.path} "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    return snapshot
+
+
+def snapshot_if_due(session, every=SNAPSHOT_EVERY, directory=EVENT_SNAPSHOT_DIR):
+    """
+    Write a new materialized snapshot once `every` events have been logged
+    since the last one. Returns the snapshot, or None if none was due.
+    """
+    latest = latest_snapshot(session)
+    last_event_id = session.query(func.max(InventoryEvent.id)).scalar() or 0
+    if last_event_id - (latest.last_event_id if latest else 0) < every:
+        return None
+    return write_event_snapshot(session, directory)
+
+
+def verify_replay(session, batch_size=REPLAY_BATCH):
+    """
+    Card ids whose replayed state differs from the cards table.
+    Run it while nothing is writing.
+    """
+    state, _ = replay_state(session, batch_size=batch_size)
+    mismatched = []
+    for card_id, tcg_id, section_id, quantity in session.execute(
+        select(Card.id, Card.tcg_id, Card.section_id, Card.quantity).execution_options(
+            yield_per=batch_size
+        )
+    ):
+        card = state.pop(card_id, None)
+        if card is None or (card[0], card[3], card[4]) != (tcg_id, section_id, quantity):
+            mismatched.append(card_id)
+    mismatched.extend(state)
+    return sorted(mismatched)
+
+
+def rebuild_from_events(session, batch_size=REPLAY_BATCH):
+    """
+    Replace the cards table and section counters with the replayed state,
+    in one transaction of batched inserts and updates, then rebuild the
+    rollups. Run it while nothing else is writing; in-memory caches of
+    other processes must be reset afterwards.
+    """
+    started = time.perf_counter()
+    state, last_event_id = replay_state(session, batch_size=batch_size)
+    cards, sections = Card.__table__, Section.__table__
+    per_section = {}
+    for _, _, _, section_id, quantity in state.values():
+        per_section[section_id] = per_section.get(section_id, 0) + quantity
+
+    try:
+        session.execute(cards.delete())
+        card_ids = sorted(state)
+        for start in range(0, len(card_ids), batch_size):
+            session.execute(
+                cards.insert(),
+                [
+                    {
+                        "id": card_id,
+                        "tcg_id": state[card_id][0],
+                        "card_name": state[card_id][1],
+                        "set_name": state[card_id][2],
+                        "section_id": state[card_id][3],
+                        "quantity": state[card_id][4],
+                    }
+                    for card_id in card_ids[start : start + batch_size]
+                ],
+            )
+        session.execute(sections.update().values(card_count=0, current_quantity=0))
+        session.execute(
+            sections.update()
+            .where(sections.c.id == bindparam("_id"))
+            .values(card_count=bindparam("_quantity"), current_quantity=bindparam("_quantity")),
+            [
+                {"_id": section_id, "_quantity": quantity}
+                for section_id, quantity in per_section.items()
+                if section_id is not None
+            ],
+        )
+        recompute_rollups(session)
+        record_section_changes(session, session.execute(select(Section.id)).scalars().all())
+        session.commit()
+    except Exception as e:
+        logger.error(f"Failed to commit session: {e}")
+        session.rollback()
+        raise
+    logger.info(
+        f"Rebuilt {len(state)} cards from events up to {last_event_id} "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    return len(state)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inventory event log replay")
+    parser.add_argument("--directory", default=EVENT_SNAPSHOT_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    snapshot_parser = commands.add_parser(
+        "snapshot", help="materialize the replayed state so replay can start there"
+    )
+    snapshot_parser.add_argument(
+        "--every",
+        type=int,
+        default=0,
+        help="only snapshot once this many events have been logged since the last one",
+    )
+    commands.add_parser("verify", help="compare the replayed state with the cards table")
+    commands.add_parser("rebuild", help="rewrite cards and section counters from the log")
+    args = parser.parse_args()
+
+    engine = create_inventory_engine()
+    Base.metadata.create_all(engine)
+    ensure_event_log(engine)
+    session = sessionmaker(bind=engine)()
+
+    if args.command == "snapshot":
+        if args.every:
+            snapshot_if_due(session, args.every, args.directory)
+        else:
+            write_event_snapshot(session, args.directory)
+    elif args.command == "verify":
+        mismatched = verify_replay(session)
+        print(f"{len(mismatched)} cards differ from the event log")
+        for card_id in mismatched[:20]:
+            print(f"    card {card_id}")
+    else:
+        rebuild_from_events(session)
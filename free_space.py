@@ -0,0 +1,97 @@
+import heapq
+
+
+class FreeSpaceIndex:
+    """
+    In-memory index of section free capacity.
+    Sections are bucketed by remaining capacity; each bucket is a min-heap of
+    section ids so the lowest (earliest box) section that fits is found first.
+    Heap entries are invalidated lazily when a section's capacity changes.
+    """
+
+    def __init__(self):
+        self._sections = {}
+        self._buckets = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build an index from (section_id, card_count, max_cards) tuples.
+        """
+        index = cls()
+        for section_id, card_count, max_cards in rows:
+            index.update(section_id, card_count, max_cards)
+        return index
+
+    def __len__(self):
+        return len(self._sections)
+
+    def __contains__(self, section_id):
+        return section_id in self._sections
+
+    def counts(self, section_id):
+        """
+        (card_count, max_cards) as last recorded for a section.
+        """
+        return self._sections[section_id]
+
+    def remaining(self, section_id):
+        card_count, max_cards = self._sections[section_id]
+        return max_cards - card_count
+
+    def update(self, section_id, card_count, max_cards):
+        """
+        Record the current counters for a section, adding it if unknown.
+        """
+        card_count = card_count or 0
+        previous = self._sections.get(section_id)
+        self._sections[section_id] = (card_count, max_cards)
+        remaining = max_cards - card_count
+        if previous is not None and previous[1] - previous[0] == remaining:
+            return
+        heapq.heappush(self._buckets.setdefault(remaining, []), section_id)
+
+    def discard(self, section_id):
+        self._sections.pop(section_id, None)
+
+    def _head(self, remaining):
+        bucket = self._buckets[remaining]
+        while bucket:
+            section_id = bucket[0]
+            if (
+                section_id in self._sections
+                and self.remaining(section_id) == remaining
+            ):
+                return section_id
+            heapq.heappop(bucket)
+        del self._buckets[remaining]
+        return None
+
+    def find(self, quantity):
+        """
+        Return the lowest section id with at least `quantity` free, or None.
+        """
+        best = None
+        for remaining in list(self._buckets):
+            if remaining < quantity:
+                continue
+            section_id = self._head(remaining)
+            if section_id is not None and (best is None or section_id < best):
+                best = section_id
+        return best
+
+    def find_best(self, quantity):
+        """
+        Return the section with the least free space that still holds
+        `quantity` (lowest id among equals), or None.
+        """
+        for remaining in sorted(self._buckets):
+            if remaining < quantity:
+                continue
+            section_id = self._head(remaining)
+            if section_id is not None:
+                return section_id
+        return None
+
+    def free_capacity(self):
+        return sum(max_cards - count for count, max_cards in self._sections.values())
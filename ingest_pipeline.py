@@ -0,0 +1,186 @@
+import argparse
+import csv
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.orm import sessionmaker
+
+from db_engine import SQLITE_PROFILES, create_inventory_engine
+from inv_manager import (
+    Base,
+    InventoryStatus,
+    bulk_insert_records,
+    card_logger,
+    ensure_event_log,
+    ensure_indexes,
+    ensure_rollups,
+    logger,
+    parse_csv_lines,
+)
+from log_config import add_logging_arguments, configure_from_args
+from placement import PLACEMENT_STRATEGIES
+
+CHUNK_BYTES = 4 * 1024 * 1024
+_DONE = object()
+
+
+def split_csv(filepath, chunk_bytes=CHUNK_BYTES):
+    """
+    Return (fieldnames, [(start, end), ...]) byte ranges that each end on a line
+    boundary. Assumes no quoted field spans a newline, which holds for
+    TCGplayer exports.
+    """
+    ranges = []
+    with open(filepath, "rb") as f:
+        header = f.readline().decode("utf-8-sig")
+        start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return next(csv.reader([header])), ranges
+
+
+def parse_chunk(filepath, fieldnames, start, end):
+    """
+    Worker: parse and validate one byte range.
+    Returns (records, invalid_ids) in file order.
+    """
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).decode("utf-8").splitlines()
+    return parse_csv_lines(lines, fieldnames)
+
+
+def _put(chunks, item, stop):
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(filepath, workers, max_pending, chunk_bytes, chunks, errors, stop):
+    """
+    Submit chunks to the pool, keeping at most max_pending in flight, and
+    hand results to the writer in file order until it is done or stops.
+    """
+    try:
+        fieldnames, ranges = split_csv(filepath, chunk_bytes)
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for start, end in ranges:
+                pending.append(pool.submit(parse_chunk, filepath, fieldnames, start, end))
+                if len(pending) >= max_pending:
+                    if not _put(chunks, pending.popleft().result(), stop):
+                        return
+            while pending:
+                if not _put(chunks, pending.popleft().result(), stop):
+                    return
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _put(chunks, _DONE, stop)
+
+
+def pipelined_upload_from_csv(
+    filepath,
+    session,
+    inventory_status,
+    workers=None,
+    queue_size=4,
+    chunk_bytes=CHUNK_BYTES,
+    batch_size=5000,
+):
+    """
+    Parse and validate the file in a process pool while this thread writes.
+    Parsed chunks pass through a bounded queue, so parsing stalls when the
+    writer falls behind, and chunks are written in file order, so placements
+    match bulk_upload_from_csv.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = queue.Queue(maxsize=queue_size)
+    errors = []
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_produce,
+        args=(filepath, workers, workers + queue_size, chunk_bytes, chunks, errors, stop),
+        daemon=True,
+    )
+
+    started = time.perf_counter()
+    producer.start()
+    rows = 0
+    inserted = 0
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            records, invalid_ids = chunk
+            for tcg_id in invalid_ids:
+                card_logger.warning("Invalid TCGplayer Id: %s. Skipping row.", tcg_id)
+            rows += len(records)
+            inserted += bulk_insert_records(
+                session, inventory_status, records, batch_size
+            )
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        producer.join()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - started
+    rate = rows / elapsed if elapsed > 0 else float("inf")
+    logger.info(
+        f"Pipelined load of {inserted}/{rows} rows in {elapsed:.2f}s ({rate:.0f} rows/sec)"
+    )
+    return {"rows": rows, "inserted": inserted, "seconds": elapsed, "rows_per_sec": rate}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Upload CSV to database with parallel parsing"
+    )
+    parser.add_argument("filepath", type=str)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / 1024 / 1024)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--profile", choices=sorted(SQLITE_PROFILES), default="bulk-load"
+    )
+    parser.add_argument(
+        "--placement", choices=sorted(PLACEMENT_STRATEGIES), default="empty-section"
+    )
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    engine = create_inventory_engine(profile=args.profile)
+    Base.metadata.create_all(engine)
+    ensure_indexes(engine)
+    ensure_rollups(engine)
+    ensure_event_log(engine)
+    session = sessionmaker(bind=engine)()
+
+    pipelined_upload_from_csv(
+        args.filepath,
+        session,
+        InventoryStatus(placement=args.placement),
+        workers=args.workers,
+        queue_size=args.queue_size,
+        chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+        batch_size=args.batch_size,
+    )
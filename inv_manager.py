@@ -1,43 +1,69 @@
 import argparse
 import json
 import csv
+import hashlib
 import logging
 import os
+import time
 from datetime import datetime
-
-from sqlalchemy import Column, ForeignKey, Integer, String, create_engine, text
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Engine,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    bindparam,
+    func,
+    inspect,
+    literal,
+    select,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, declarative_base, relationship, sessionmaker
-from termcolor import colored
+
+from db_engine import (
+    DATABASE_URL_ENV,
+    SQLITE_PROFILES,
+    copy_rows,
+    create_inventory_engine,
+    is_postgresql,
+    reserve_ids,
+)
+from free_space import FreeSpaceIndex
+from log_config import (
+    add_logging_arguments,
+    configure_from_args,
+    get_logger,
+    get_sampled_logger,
+)
+from metrics import metrics
+from placement import PLACEMENT_STRATEGIES, make_placement_strategy
 
 Base = declarative_base()
 
 MAX_ROWS = 5
 MAX_SECTIONS_PER_ROW = 10
 MAX_CARDS_PER_SECTION = 1200
+CARD_CAPACITY = 12
+SECTION_CAPACITY = 12
+PICK_QUERY_CHUNK = 500
+ALLOCATION_RETRIES = 5
 
-
-class ColoredFormatter(logging.Formatter):
-    COLORS = {
-        "WARNING": "yellow",
-        "INFO": "green",
-        "DEBUG": "blue",
-        "CRITICAL": "red",
-        "ERROR": "red",
-    }
-
-    def format(self, record):
-        log_message = super(ColoredFormatter, self).format(record)
-        return colored(log_message, self.COLORS.get(record.levelname))
+EVENT_INTAKE = "intake"
+EVENT_PICK = "pick"
+EVENT_MOVE = "move"
+EVENT_ADJUST = "adjust"
 
 
-logger = logging.getLogger(__name__)
-logger.propagate = False
-handler = logging.StreamHandler()
-formatter = ColoredFormatter("[%(levelname)s] - %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
+logger = get_logger(__name__)
+card_logger = get_sampled_logger(logger)
 
 
 class Card(Base):
@@ -49,12 +75,12 @@ class Card(Base):
     __tablename__ = "cards"
 
     id = Column(Integer, primary_key=True)
-    section_id = Column(Integer, ForeignKey("sections.id"))
-    tcg_id = Column(Integer, nullable=False)
+    section_id = Column(Integer, ForeignKey("sections.id"), index=True)
+    tcg_id = Column(Integer, nullable=False, index=True)
     card_name = Column(String)
     set_name = Column(String)
     quantity = Column(Integer, default=0)
-    capacity = Column(Integer, default=12)
+    capacity = Column(Integer, default=CARD_CAPACITY)
 
     section = relationship("Section", back_populates="cards")
 
@@ -75,9 +101,9 @@ class Section(Base):
     __tablename__ = "sections"
 
     id = Column(Integer, primary_key=True)
-    row_id = Column(Integer, ForeignKey("rows.id"))
+    row_id = Column(Integer, ForeignKey("rows.id"), index=True)
     card_count = Column(Integer, default=0)
-    max_cards = Column(Integer, default=12)
+    max_cards = Column(Integer, default=SECTION_CAPACITY)
     current_quantity = Column(Integer, default=0)
 
     row = relationship("Row", back_populates="sections")
@@ -104,6 +130,22 @@ class Section(Base):
             }
 
 
+# Covering index over sections that still have room, led by row_id so the
+# free-space query reads it whether it starts from sections or joins in
+# from rows, without touching full sections.
+Index(
+    "ix_sections_free_by_row",
+    Section.row_id,
+    Section.card_count,
+    Section.max_cards,
+    sqlite_where=Section.card_count < Section.max_cards,
+    postgresql_where=Section.card_count < Section.max_cards,
+)
+
+# Indexes from older schemas that a differently named index now covers.
+SUPERSEDED_INDEXES = ["ix_sections_free_capacity"]
+
+
 class Row(Base):
     """
     contains 10 Sections, 5 Rows constitute a box.
@@ -112,9 +154,10 @@ class Row(Base):
     __tablename__ = "rows"
 
     id = Column(Integer, primary_key=True)
-    box_id = Column(Integer, ForeignKey("boxes.id"))
+    box_id = Column(Integer, ForeignKey("boxes.id"), index=True)
     section_count = Column(Integer, default=0)
     max_sections = Column(Integer, default=10)
+    free_capacity = Column(Integer, default=0)
 
     box = relationship("Box", back_populates="rows")
     sections = relationship("Section", back_populates="row")
@@ -150,6 +193,8 @@ class Box(Base):
     location = Column(String)
     row_count = Column(Integer, default=0)
     max_rows = Column(Integer, default=5)
+    free_capacity = Column(Integer, default=0)
+    quantity = Column(Integer, default=0)
 
     rows = relationship("Row", back_populates="box")
 
@@ -164,13 +209,6 @@ class Box(Base):
         super(Box, self).__init__(*args, **kwargs)
         self.max_rows = self.max_rows if self.max_rows is not None else 5
         self.row_count = self.row_count if self.row_count is not None else 0
-        self.rows = []
-        for _ in range(self.max_rows):
-            new_row = Row()
-            self.add_row(new_row)
-            for _ in range(new_row.max_sections):
-                new_section = Section()
-                new_row.add_section(new_section)
 
     def to_dict(self):
         return {
@@ -178,8 +216,236 @@ class Box(Base):
             }
 
 
+class SectionChange(Base):
+    """
+    Change log entry written whenever a section's cards or counters change.
+    Delta snapshots export the sections logged after their base snapshot.
+    """
+
+    __tablename__ = "section_changes"
+
+    id = Column(Integer, primary_key=True)
+    section_id = Column(Integer, ForeignKey("sections.id"), nullable=False, index=True)
+    changed_at = Column(DateTime, default=datetime.now)
+
+
+class Snapshot(Base):
+    """
+    An exported inventory snapshot file. Full snapshots have no base;
+    deltas hold only the sections changed since base_snapshot_id.
+    """
+
+    __tablename__ = "snapshots"
+
+    id = Column(Integer, primary_key=True)
+    base_snapshot_id = Column(Integer, ForeignKey("snapshots.id"))
+    last_change_id = Column(Integer, default=0)
+    path = Column(String)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class CapacityAudit(Base):
+    """
+    One run of the capacity auditor. Incremental audits check only the
+    sections logged in section_changes after the previous audit.
+    """
+
+    __tablename__ = "capacity_audits"
+
+    id = Column(Integer, primary_key=True)
+    last_change_id = Column(Integer, default=0)
+    incremental = Column(Boolean, default=False)
+    sections_checked = Column(Integer, default=0)
+    drifted = Column(Integer, default=0)
+    repaired = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class InventoryEvent(Base):
+    """
+    Append-only log of every change to card stock, written in the same
+    transaction as the change. quantity is the signed change to the card
+    (zero for moves); a card whose quantity reaches zero is gone. Replaying
+    the log (see events.py) rebuilds cards and section counters.
+    """
+
+    __tablename__ = "inventory_events"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    card_id = Column(Integer, nullable=False)
+    tcg_id = Column(Integer)
+    section_id = Column(Integer)
+    from_section_id = Column(Integer)
+    quantity = Column(Integer, default=0)
+    card_name = Column(String)
+    set_name = Column(String)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class EventSnapshot(Base):
+    """
+    Card state materialized from the event log up to last_event_id, so
+    replay can start there instead of from the first event.
+    """
+
+    __tablename__ = "event_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    last_event_id = Column(Integer, nullable=False)
+    card_rows = Column(Integer, default=0)
+    path = Column(String)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class IngestJournal(Base):
+    """
+    Progress of a resumable CSV ingest, keyed by the file's SHA-256.
+    Advanced in the same transaction as each batch of cards it covers.
+    """
+
+    __tablename__ = "ingest_journal"
+
+    id = Column(Integer, primary_key=True)
+    file_hash = Column(String(64), nullable=False, unique=True)
+    filepath = Column(String)
+    byte_offset = Column(Integer, default=0)
+    row_number = Column(Integer, default=0)
+    completed = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+def record_section_changes(session, section_ids):
+    if section_ids:
+        session.execute(
+            SectionChange.__table__.insert(),
+            [{"section_id": section_id} for section_id in section_ids],
+        )
+
+
+def card_event(
+    kind,
+    card_id,
+    quantity,
+    tcg_id=None,
+    section_id=None,
+    from_section_id=None,
+    card_name=None,
+    set_name=None,
+):
+    return {
+        "kind": kind,
+        "card_id": card_id,
+        "quantity": quantity,
+        "tcg_id": tcg_id,
+        "section_id": section_id,
+        "from_section_id": from_section_id,
+        "card_name": card_name,
+        "set_name": set_name,
+    }
+
+
+def record_events(session, events):
+    if events:
+        session.execute(InventoryEvent.__table__.insert(), events)
+
+
+def recompute_rollups(bind):
+    """
+    Rebuild every Row free_capacity and Box free_capacity and quantity from
+    the section counters with two set-based UPDATEs.
+    """
+    rows, boxes = Row.__table__, Box.__table__
+    bind.execute(
+        rows.update().values(
+            free_capacity=select(
+                func.coalesce(func.sum(Section.max_cards - Section.card_count), 0)
+            )
+            .where(Section.row_id == rows.c.id)
+            .scalar_subquery()
+        )
+    )
+    bind.execute(
+        boxes.update().values(
+            free_capacity=select(func.coalesce(func.sum(rows.c.free_capacity), 0))
+            .where(rows.c.box_id == boxes.c.id)
+            .scalar_subquery(),
+            quantity=select(func.coalesce(func.sum(Section.card_count), 0))
+            .join(rows, Section.row_id == rows.c.id)
+            .where(rows.c.box_id == boxes.c.id)
+            .scalar_subquery(),
+        )
+    )
+
+
+def apply_capacity_deltas(session, deltas):
+    """
+    Carry section counter changes up to the Row and Box rollups. deltas
+    maps section_id -> quantity added (negative when removed); call this
+    once per transaction, after the section UPDATEs, so the rollups commit
+    with them.
+
+    Write paths take row locks in one order: cards, then sections, then
+    rows and boxes here, each in id order. Keeping to it means concurrent
+    stations on PostgreSQL wait for each other but never deadlock.
+    """
+    deltas = {section_id: added for section_id, added in deltas.items() if added}
+    if not deltas:
+        return
+    per_row = {}
+    per_box = {}
+    section_ids = list(deltas)
+    for start in range(0, len(section_ids), PICK_QUERY_CHUNK):
+        for section_id, row_id, box_id in session.execute(
+            select(Section.id, Section.row_id, Row.box_id)
+            .join(Row, Section.row_id == Row.id)
+            .where(Section.id.in_(section_ids[start : start + PICK_QUERY_CHUNK]))
+        ):
+            per_row[row_id] = per_row.get(row_id, 0) + deltas[section_id]
+            per_box[box_id] = per_box.get(box_id, 0) + deltas[section_id]
+
+    rows, boxes = Row.__table__, Box.__table__
+    session.execute(
+        rows.update()
+        .where(rows.c.id == bindparam("_id"))
+        .values(free_capacity=rows.c.free_capacity - bindparam("_added")),
+        [
+            {"_id": row_id, "_added": quantity}
+            for row_id, quantity in sorted(per_row.items())
+        ],
+    )
+    session.execute(
+        boxes.update()
+        .where(boxes.c.id == bindparam("_id"))
+        .values(
+            free_capacity=boxes.c.free_capacity - bindparam("_added"),
+            quantity=boxes.c.quantity + bindparam("_added"),
+        ),
+        [
+            {"_id": box_id, "_added": quantity}
+            for box_id, quantity in sorted(per_box.items())
+        ],
+    )
+
+
+def inventory_totals(session):
+    """
+    {"free_capacity", "quantity"} for the whole inventory, summed over the
+    Box rollups rather than aggregated over sections. There is no single
+    totals row for every intake to update, so stations filling different
+    boxes never wait on each other.
+    """
+    free_capacity, quantity = session.execute(
+        select(
+            func.coalesce(func.sum(Box.free_capacity), 0),
+            func.coalesce(func.sum(Box.quantity), 0),
+        )
+    ).one()
+    return {"free_capacity": free_capacity, "quantity": quantity}
+
+
 class InventoryStatus:
-    def __init__(self):
+    def __init__(self, placement="empty-section", location=None):
         self.current_box = None
         self.current_row = None
         self.current_section = None
@@ -189,6 +455,71 @@ class InventoryStatus:
         self.total_section_count = 0
         self.total_row_count = 0
         self.total_box_count = 0
+        self.free_space = None
+        self.sku_cache = None
+        self.placement = make_placement_strategy(placement, SECTION_CAPACITY)
+        self.location = location
+
+    def reset_caches(self):
+        """
+        Drop the in-memory indexes after a failed write; they are rebuilt
+        from the database on next use.
+        """
+        self.free_space = None
+        self.sku_cache = None
+        self.placement.reset()
+
+    def placement_strategy(self, session):
+        """
+        The placement strategy, seeded with the latest section per set on
+        first use if it keeps that history.
+        """
+        if self.placement.needs_history():
+            self.placement.load_history(
+                session.execute(
+                    select(Card.set_name, func.max(Card.section_id))
+                    .where(Card.section_id.is_not(None))
+                    .group_by(Card.set_name)
+                ).all()
+            )
+        return self.placement
+
+    def sku_index(self, session):
+        """
+        tcg_id -> [card_id, section_id, room_on_card] for the newest card of
+        each SKU still below its capacity. Built with one query on first use,
+        then maintained by insert_card, the bulk loader and remove_cards.
+        """
+        if self.sku_cache is None:
+            self.sku_cache = {
+                tcg_id: [card_id, section_id, capacity - quantity]
+                for card_id, tcg_id, section_id, capacity, quantity in session.query(
+                    Card.id, Card.tcg_id, Card.section_id, Card.capacity, Card.quantity
+                )
+                .filter(Card.quantity < Card.capacity)
+                .order_by(Card.id)
+            }
+        return self.sku_cache
+
+    def free_space_index(self, session):
+        """
+        Free-capacity index over every section, built from the database on
+        first use and kept current by insert_card/remove_cards afterwards.
+        Boxes and rows whose free_capacity rollup is zero are skipped
+        without reading their sections.
+        """
+        if self.free_space is None:
+            self.free_space = FreeSpaceIndex.from_rows(
+                session.query(Section.id, Section.card_count, Section.max_cards)
+                .join(Row, Section.row_id == Row.id)
+                .join(Box, Row.box_id == Box.id)
+                .filter(
+                    Box.free_capacity > 0,
+                    Row.free_capacity > 0,
+                    Section.card_count < Section.max_cards,
+                )
+            )
+        return self.free_space
 
     def update_after_insertion(self, current_box, current_row, current_section):
         self.current_box = current_box
@@ -197,44 +528,86 @@ class InventoryStatus:
         self.last_insertion_date = datetime.now()
 
 
-def locate_insertion_point(session, inventory_status, tcg_id, quantity):
-    logger.debug("Entering locate_insertion_point")
+def create_box(session, **box_fields):
+    """
+    Insert a Box with its full MAX_ROWS x MAX_SECTIONS_PER_ROW grid as a
+    handful of Core statements rather than one ORM flush per row and section.
+    Returns (box_id, [(section_id, card_count, max_cards), ...]).
+    """
+    row_capacity = MAX_SECTIONS_PER_ROW * SECTION_CAPACITY
+    box_id = session.execute(
+        Box.__table__.insert().values(
+            row_count=MAX_ROWS,
+            max_rows=MAX_ROWS,
+            free_capacity=MAX_ROWS * row_capacity,
+            quantity=0,
+            **box_fields,
+        )
+    ).inserted_primary_key[0]
+    session.execute(
+        Row.__table__.insert(),
+        [
+            {
+                "box_id": box_id,
+                "section_count": MAX_SECTIONS_PER_ROW,
+                "max_sections": MAX_SECTIONS_PER_ROW,
+                "free_capacity": row_capacity,
+            }
+            for _ in range(MAX_ROWS)
+        ],
+    )
+    row_ids = (
+        session.execute(select(Row.id).where(Row.box_id == box_id).order_by(Row.id))
+        .scalars()
+        .all()
+    )
+    session.execute(
+        Section.__table__.insert(),
+        [
+            {"row_id": row_id}
+            for row_id in row_ids
+            for _ in range(MAX_SECTIONS_PER_ROW)
+        ],
+    )
+    sections = session.execute(
+        select(Section.id, Section.card_count, Section.max_cards)
+        .join(Row, Section.row_id == Row.id)
+        .where(Row.box_id == box_id)
+        .order_by(Section.id)
+    ).all()
+    return box_id, sections
 
-    last_box = session.query(Box).order_by(Box.id.desc()).first()
-    logger.debug(f"Last box: {last_box}")
 
-    if not last_box:
-        last_box = Box()
-        session.add(last_box)
-        session.flush()
-        logger.debug("Created a new box")
+def open_new_box(session, inventory_status):
+    box_id, sections = create_box(session, location=inventory_status.location)
+    index = inventory_status.free_space_index(session)
+    for section_id, card_count, max_cards in sections:
+        index.update(section_id, card_count, max_cards)
+    logger.debug("Created a new box: %s", box_id)
+    return box_id
 
-    for row in last_box.rows:
-        logger.debug(f"Checking row: {row}")
-        if row.sections is not None:
-            for section in row.sections:
-                logging.debug(f"Checking section: {section}")
-                if section.can_add_card(12):
-                    current_section = section
-                    current_row = row
-                    logger.debug(f"Located suitable section: {current_section}")
-                    return current_section
-                else:
-                    logger.debug(f"Section is full: {section}")
 
-    new_box = Box()
-    for _ in range(5):
-        new_row = Row()
-        new_box.add_row(new_row)
-        for _ in range(10):
-            new_section = Section()
-            new_row.add_section(new_section)
+def choose_section(session, inventory_status, quantity, set_name=None):
+    """
+    Ask the placement strategy for a section, opening a new box when none
+    fits. Quantities above SECTION_CAPACITY are asked for as a full
+    section so they fail at reservation instead of opening boxes.
+    """
+    index = inventory_status.free_space_index(session)
+    strategy = inventory_status.placement_strategy(session)
+    quantity = min(quantity, SECTION_CAPACITY)
+    section_id = strategy.choose(index, quantity, set_name)
+    if section_id is None:
+        open_new_box(session, inventory_status)
+        section_id = strategy.choose(index, quantity, set_name)
+    return section_id
 
-    session.add(new_box)
-    session.flush()
-    logger.debug(f"Created a new box: {new_box}")
 
-    return new_box.rows[0].sections[0]
+def locate_insertion_point(session, inventory_status, tcg_id, quantity, set_name=None):
+    section_id = choose_section(session, inventory_status, quantity, set_name)
+    current_section = session.get(Section, section_id)
+    card_logger.debug("Located section %s for %s x%s", section_id, tcg_id, quantity)
+    return current_section
 
 
 def prepare_card(tcg_id, card_name, set_name, quantity, section_id=None):
@@ -248,6 +621,138 @@ def prepare_card(tcg_id, card_name, set_name, quantity, section_id=None):
     return new_card
 
 
+def merge_room(index, entry):
+    """
+    How much more an existing card can take: bounded by its own capacity
+    and by the free space left in its section.
+    """
+    section_id = entry[1]
+    section_room = index.remaining(section_id) if section_id in index else 0
+    return max(0, min(entry[2], section_room))
+
+
+def reserve_section_capacity(session, section_id, quantity):
+    """
+    Atomically claim quantity in a section. The WHERE clause re-checks the
+    capacity in the database, so stations working from stale in-memory
+    counters can never overfill a section. The caller passes the change on
+    to apply_capacity_deltas before committing. Returns True if the claim
+    held.
+    """
+    sections = Section.__table__
+    result = session.execute(
+        sections.update()
+        .where(
+            sections.c.id == section_id,
+            sections.c.card_count + quantity <= sections.c.max_cards,
+        )
+        .values(
+            card_count=sections.c.card_count + quantity,
+            current_quantity=sections.c.current_quantity + quantity,
+        )
+    )
+    return result.rowcount == 1
+
+
+def claim_section(session, section_id, quantity):
+    """
+    reserve_section_capacity for new cards. On PostgreSQL the chosen
+    section is first locked with FOR UPDATE SKIP LOCKED; if another
+    station holds it, the lowest unlocked section with room is claimed
+    instead of waiting. Returns the id of the section claimed, or None.
+    """
+    if is_postgresql(session):
+        locked = session.execute(
+            select(Section.id)
+            .where(Section.id == section_id)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+        if locked is None:
+            metrics.count("insert_card.skipped_locked")
+            section_id = session.execute(
+                select(Section.id)
+                .where(Section.card_count + quantity <= Section.max_cards)
+                .order_by(Section.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).scalar()
+            if section_id is None:
+                return None
+    if not reserve_section_capacity(session, section_id, quantity):
+        return None
+    return section_id
+
+
+def refresh_section(session, inventory_status, section_id):
+    """
+    Reload one section's counters into the free-space index after another
+    station changed it underneath us.
+    """
+    card_count, max_cards = session.execute(
+        select(Section.card_count, Section.max_cards).where(Section.id == section_id)
+    ).one()
+    inventory_status.free_space_index(session).update(section_id, card_count, max_cards)
+
+
+def merge_quantity(session, inventory_status, tcg_id, quantity):
+    """
+    How much of quantity merge_into_existing_card would add to the cached
+    card for tcg_id.
+    """
+    entry = inventory_status.sku_index(session).get(tcg_id)
+    if entry is None or quantity <= 0:
+        return 0
+    return min(quantity, merge_room(inventory_status.free_space_index(session), entry))
+
+
+def merge_into_existing_card(session, inventory_status, tcg_id, quantity, deltas):
+    """
+    Top up the cached card for tcg_id with as much of quantity as fits.
+    Both the card and its section are updated conditionally, in that
+    order, so a top-up that raced another station is dropped rather than
+    overfilling. The section change is added to deltas for the caller's
+    apply_capacity_deltas. Returns the quantity merged; the caller commits.
+    """
+    merged = merge_quantity(session, inventory_status, tcg_id, quantity)
+    if merged <= 0:
+        return 0
+
+    index = inventory_status.free_space_index(session)
+    entry = inventory_status.sku_index(session)[tcg_id]
+    card_id, section_id, _ = entry
+    cards = Card.__table__
+    result = session.execute(
+        cards.update()
+        .where(
+            cards.c.id == card_id,
+            cards.c.section_id == section_id,
+            cards.c.quantity + merged <= cards.c.capacity,
+        )
+        .values(quantity=cards.c.quantity + merged)
+    )
+    if result.rowcount != 1:
+        del inventory_status.sku_index(session)[tcg_id]
+        return 0
+    if not reserve_section_capacity(session, section_id, merged):
+        session.execute(
+            cards.update()
+            .where(cards.c.id == card_id)
+            .values(quantity=cards.c.quantity - merged)
+        )
+        refresh_section(session, inventory_status, section_id)
+        return 0
+    deltas[section_id] = deltas.get(section_id, 0) + merged
+    record_section_changes(session, [section_id])
+    record_events(
+        session, [card_event(EVENT_INTAKE, card_id, merged, tcg_id, section_id)]
+    )
+
+    card_count, max_cards = index.counts(section_id)
+    index.update(section_id, card_count + merged, max_cards)
+    entry[2] -= merged
+    return merged
+
+
 def insert_card(
     session: Session,
     inventory_status: InventoryStatus,
@@ -256,65 +761,435 @@ def insert_card(
     set_name,
     quantity,
 ):
-    section = locate_insertion_point(session, inventory_status, tcg_id, quantity)
-    if section:
-        new_card = Card(
-            tcg_id=tcg_id, card_name=card_name, set_name=set_name, quantity=quantity
+    """
+    Store quantity of a card: top up the existing card for the SKU, then
+    place what is left as a new card. The top-up and the new card commit
+    together, so a row that cannot be stored leaves nothing behind.
+    """
+    remainder = quantity - merge_quantity(session, inventory_status, tcg_id, quantity)
+    if remainder > SECTION_CAPACITY:
+        metrics.count("insert_card.failed")
+        card_logger.warning(
+            "Cannot store %s: %s cards do not fit in one section",
+            card_name,
+            remainder,
+            extra={"tcg_id": tcg_id},
         )
-        new_card.section_id = section.id
+        return False
 
-        if section.add_card(new_card):
-            session.add(section)
-            session.commit()
-            logger.debug("Successfully added card to section.")
-            section.current_quantity += quantity
+    deltas = {}
+    try:
+        with metrics.timer("insert_card.merge"):
+            merged = merge_into_existing_card(
+                session, inventory_status, tcg_id, quantity, deltas
+            )
+        if merged:
+            metrics.count("insert_card.merged")
+            if merged == quantity:
+                apply_capacity_deltas(session, deltas)
+                with metrics.timer("insert_card.commit"):
+                    session.commit()
+    except Exception as e:
+        logger.error(f"Failed to commit session: {e}")
+        session.rollback()
+        inventory_status.reset_caches()
+        metrics.count("insert_card.failed")
+        return False
 
-            inventory_status.update_after_insertion(
-                inventory_status.current_box, inventory_status.current_row, section
+    quantity -= merged
+    if merged and quantity == 0:
+        card_logger.debug(
+            "Added %s to inventory",
+            card_name,
+            extra={"tcg_id": tcg_id, "merged": merged},
+        )
+        return True
+
+    # Another station may have filled the card since the pre-check, leaving
+    # more than one section can hold; skip straight to the failure path.
+    retries = ALLOCATION_RETRIES if quantity <= SECTION_CAPACITY else 0
+    index = inventory_status.free_space_index(session)
+    for _ in range(retries):
+        with metrics.timer("insert_card.locate"):
+            section = locate_insertion_point(
+                session, inventory_status, tcg_id, quantity, set_name
             )
-            session.add(new_card)
-            try:
+        if not section:
+            break
+        try:
+            with metrics.timer("insert_card.reserve"):
+                claimed = claim_section(session, section.id, quantity)
+            if claimed is None:
+                metrics.count("insert_card.reserve_conflicts")
+                refresh_section(session, inventory_status, section.id)
+                if index.remaining(section.id) >= SECTION_CAPACITY:
+                    card_logger.debug(
+                        "Section %s cannot hold %s cards", section.id, quantity
+                    )
+                    break
+                card_logger.debug(
+                    "Section %s filled by another station; retrying", section.id
+                )
+                continue
+            if claimed != section.id:
+                section = session.get(Section, claimed)
+            deltas[section.id] = deltas.get(section.id, 0) + quantity
+
+            new_card = Card(
+                tcg_id=tcg_id,
+                card_name=card_name,
+                set_name=set_name,
+                quantity=quantity,
+                section_id=section.id,
+            )
+            with metrics.timer("insert_card.flush"):
+                session.add(new_card)
+                session.flush()
+                record_section_changes(session, [section.id])
+                record_events(
+                    session,
+                    [
+                        card_event(
+                            EVENT_INTAKE,
+                            new_card.id,
+                            quantity,
+                            tcg_id,
+                            section.id,
+                            card_name=card_name,
+                            set_name=set_name,
+                        )
+                    ],
+                )
+                apply_capacity_deltas(session, deltas)
+            with metrics.timer("insert_card.commit"):
                 session.commit()
-            except Exception as e:
-                logger.error(f"Failed to commit session: {e}")
-                session.rollback()
-
-            print(f"Successfully added {card_name} to inventory.")
-        else:
-            logger.debug("Failed to add card to section.")
-            print(f"Failed to insert {card_name}. Open section not found.")
-    else:
-        print(f"Failed to insert {card_name}. Open section not found.")
+        except Exception as e:
+            logger.error(f"Failed to commit session: {e}")
+            session.rollback()
+            inventory_status.reset_caches()
+            metrics.count("insert_card.failed")
+            return False
+
+        # The claim may have fallen back to a section this station has
+        # not indexed yet, so its counters are read back rather than bumped.
+        refresh_section(session, inventory_status, section.id)
+        inventory_status.placement.placed(section.id, set_name)
+        inventory_status.sku_index(session)[tcg_id] = [
+            new_card.id,
+            section.id,
+            new_card.capacity - quantity,
+        ]
+        inventory_status.update_after_insertion(
+            inventory_status.current_box, inventory_status.current_row, section
+        )
+        metrics.count("insert_card.placed")
+        card_logger.debug(
+            "Added %s to inventory",
+            card_name,
+            extra={"tcg_id": tcg_id, "section_id": section.id, "quantity": quantity},
+        )
+        return True
+
+    # The rollback may have undone a merge or a box opened for this card,
+    # so the in-memory indexes are rebuilt rather than trusted.
+    session.rollback()
+    inventory_status.reset_caches()
+    metrics.count("insert_card.failed")
+    card_logger.warning(
+        "Failed to insert %s. Open section not found.",
+        card_name,
+        extra={"tcg_id": tcg_id},
+    )
+    return False
 
 
 def update_card_quantity(
     session: Session, inventory_status: InventoryStatus, tcg_id, additional_quantity
 ):
+    """
+    Add to an SKU already in stock. insert_card tops up the existing card
+    to its capacity and spills anything left over into a new card.
+    """
     existing_card = session.query(Card).filter_by(tcg_id=tcg_id).first()
 
     if existing_card:
-        new_quantity = existing_card.quantity + additional_quantity
-
-        if new_quantity > existing_card.max_quantity:
-            spillover_quantity = new_quantity - existing_card.max_quantity
+        card_name = existing_card.card_name
+        insert_card(
+            session,
+            inventory_status,
+            tcg_id,
+            card_name,
+            existing_card.set_name,
+            additional_quantity,
+        )
+        card_logger.debug("Updated the quantity of %s", card_name)
+    else:
+        card_logger.warning("Card with TCG ID %s not found.", tcg_id)
 
-            existing_card.quantity = existing_card.max_quantity
 
-            insert_card(
+def remove_cards(session: Session, inventory_status: InventoryStatus, cards):
+    """
+    Delete Card rows and give their quantity back to their sections. The
+    quantity and section of each card are read back in the transaction and
+    the sections decremented with relative UPDATEs, like remove_quantities,
+    so capacity claimed by other stations since the cards were loaded is
+    left intact.
+    """
+    card_ids = sorted({card.id for card in cards})
+    if not card_ids:
+        return
+    cards, sections = Card.__table__, Section.__table__
+    removed = []
+    per_section = {}
+    counters = []
+    try:
+        with metrics.timer("remove_cards.stage"):
+            for start in range(0, len(card_ids), PICK_QUERY_CHUNK):
+                chunk = card_ids[start : start + PICK_QUERY_CHUNK]
+                removed.extend(
+                    session.execute(
+                        select(Card.id, Card.tcg_id, Card.section_id, Card.quantity)
+                        .where(Card.id.in_(chunk))
+                        .order_by(Card.id)
+                        .with_for_update()
+                    )
+                )
+                session.execute(cards.delete().where(cards.c.id.in_(chunk)))
+            for _, _, section_id, quantity in removed:
+                if section_id is not None:
+                    per_section[section_id] = per_section.get(section_id, 0) + quantity
+        with metrics.timer("remove_cards.flush"):
+            session.execute(
+                sections.update()
+                .where(sections.c.id == bindparam("_id"))
+                .values(
+                    card_count=sections.c.card_count - bindparam("_removed"),
+                    current_quantity=sections.c.current_quantity - bindparam("_removed"),
+                ),
+                [
+                    {"_id": section_id, "_removed": quantity}
+                    for section_id, quantity in sorted(per_section.items())
+                ],
+            )
+            apply_capacity_deltas(
                 session,
-                inventory_status,
-                tcg_id,
-                existing_card.card_name,
-                existing_card.set_name,
-                spillover_quantity,
+                {section_id: -quantity for section_id, quantity in per_section.items()},
             )
-        else:
-            existing_card.quantity = new_quantity
+            record_section_changes(session, list(per_section))
+            record_events(
+                session,
+                [
+                    card_event(EVENT_ADJUST, card_id, -quantity, tcg_id, section_id)
+                    for card_id, tcg_id, section_id, quantity in removed
+                ],
+            )
+            section_ids = list(per_section)
+            for start in range(0, len(section_ids), PICK_QUERY_CHUNK):
+                counters.extend(
+                    session.execute(
+                        select(Section.id, Section.card_count, Section.max_cards).where(
+                            Section.id.in_(section_ids[start : start + PICK_QUERY_CHUNK])
+                        )
+                    )
+                )
+        with metrics.timer("remove_cards.commit"):
+            session.commit()
+    except Exception as e:
+        logger.error(f"Failed to commit session: {e}")
+        session.rollback()
+        inventory_status.reset_caches()
+        raise
+    metrics.count("remove_cards.cards", len(removed))
+
+    index = inventory_status.free_space_index(session)
+    for section_id, card_count, max_cards in counters:
+        index.update(section_id, card_count, max_cards)
+    skus = inventory_status.sku_index(session)
+    for card_id, tcg_id, _, _ in removed:
+        entry = skus.get(tcg_id)
+        if entry is not None and entry[0] == card_id:
+            del skus[tcg_id]
+    inventory_status.last_removal_date = datetime.now()
+
+
+def pick_candidates(session, tcg_ids):
+    """
+    {tcg_id: [("box.row.section", card_id, quantity), ...]} in storage
+    order, loaded with one joined query per PICK_QUERY_CHUNK ids.
+    """
+    tcg_ids = sorted(set(tcg_ids))
+    candidates = {}
+    with metrics.timer("resolve_pick_list.query"):
+        for start in range(0, len(tcg_ids), PICK_QUERY_CHUNK):
+            statement = (
+                select(Box.id, Row.id, Section.id, Card.id, Card.tcg_id, Card.quantity)
+                .join(Row, Row.box_id == Box.id)
+                .join(Section, Section.row_id == Row.id)
+                .join(Card, Card.section_id == Section.id)
+                .where(Card.tcg_id.in_(tcg_ids[start : start + PICK_QUERY_CHUNK]))
+                .order_by(Box.id, Row.id, Section.id, Card.id)
+            )
+            for box_id, row_id, section_id, card_id, tcg_id, quantity in session.execute(
+                statement
+            ):
+                candidates.setdefault(tcg_id, []).append(
+                    (f"{box_id}.{row_id}.{section_id}", card_id, quantity)
+                )
+    return candidates
 
-        session.commit()
-        print(f"Successfully updated the quantity of {existing_card.card_name}.")
-    else:
-        print(f"Card with TCG ID {tcg_id} not found.")
+
+def allocate_picks(candidates, order_lines):
+    """
+    Allocate (tcg_id, quantity) order lines against pick_candidates output.
+    Repeated SKUs draw down the same cards. Returns, per order line, a list
+    of {"Location", "card_id", "Card Count"} picks.
+    """
+    available = {}
+    resolved = []
+    with metrics.timer("resolve_pick_list.allocate"):
+        for tcg_id, needed_quantity in order_lines:
+            picks = []
+            for location, card_id, quantity in candidates.get(tcg_id, ()):
+                if needed_quantity <= 0:
+                    break
+                remaining = available.setdefault(card_id, quantity)
+                if remaining <= 0:
+                    continue
+                taken = min(remaining, needed_quantity)
+                available[card_id] = remaining - taken
+                needed_quantity -= taken
+                picks.append({"Location": location, "card_id": card_id, "Card Count": taken})
+            resolved.append(picks)
+    return resolved
+
+
+def resolve_pick_list(session, order_lines):
+    """
+    Allocate (tcg_id, quantity) order lines against stock. Returns, per
+    order line, a list of {"Location": "box.row.section", "card_id",
+    "Card Count"} picks.
+    """
+    candidates = pick_candidates(session, [tcg_id for tcg_id, _ in order_lines])
+    return allocate_picks(candidates, order_lines)
+
+
+def remove_quantities(session: Session, inventory_status: InventoryStatus, picks):
+    """
+    Take picked quantities out of stock. picks are {"card_id", "Card Count"}
+    dicts as returned by resolve_pick_list. Cards are decremented with one
+    executemany UPDATE, emptied cards are deleted in chunked IN lists, and
+    section counters and the change log are updated in the same transaction.
+    A pick larger than the card's stock removes only what the card held.
+    Returns the number of cards deleted.
+    """
+    removed = {}
+    for pick in picks:
+        removed[pick["card_id"]] = removed.get(pick["card_id"], 0) + pick["Card Count"]
+    if not removed:
+        return 0
+
+    cards, sections = Card.__table__, Section.__table__
+    card_ids = list(removed)
+    remaining = []
+    taken = {}
+    per_section = {}
+    counters = []
+    try:
+        with metrics.timer("remove_quantities.decrement"):
+            session.execute(
+                cards.update()
+                .where(cards.c.id == bindparam("_id"))
+                .values(quantity=cards.c.quantity - bindparam("_removed")),
+                [
+                    {"_id": card_id, "_removed": quantity}
+                    for card_id, quantity in sorted(removed.items())
+                ],
+            )
+        for start in range(0, len(card_ids), PICK_QUERY_CHUNK):
+            chunk = card_ids[start : start + PICK_QUERY_CHUNK]
+            remaining.extend(
+                session.execute(
+                    select(
+                        Card.id, Card.tcg_id, Card.section_id, Card.quantity, Card.capacity
+                    ).where(Card.id.in_(chunk))
+                )
+            )
+            session.execute(
+                cards.delete().where(cards.c.id.in_(chunk), cards.c.quantity <= 0)
+            )
+
+        # A stale pick can ask for more than the card held; only the stock
+        # actually there comes out of the section and the event log.
+        for card_id, _, section_id, quantity, _ in remaining:
+            taken[card_id] = removed[card_id] + min(quantity, 0)
+            if taken[card_id] < removed[card_id]:
+                logger.warning(
+                    "Card %s held %s of %s picked",
+                    card_id,
+                    taken[card_id],
+                    removed[card_id],
+                )
+            per_section[section_id] = per_section.get(section_id, 0) + taken[card_id]
+        if per_section:
+            session.execute(
+                sections.update()
+                .where(sections.c.id == bindparam("_id"))
+                .values(
+                    card_count=sections.c.card_count - bindparam("_removed"),
+                    current_quantity=sections.c.current_quantity - bindparam("_removed"),
+                ),
+                [
+                    {"_id": section_id, "_removed": quantity}
+                    for section_id, quantity in sorted(per_section.items())
+                ],
+            )
+        apply_capacity_deltas(
+            session,
+            {section_id: -quantity for section_id, quantity in per_section.items()},
+        )
+        record_section_changes(session, list(per_section))
+        record_events(
+            session,
+            [
+                card_event(EVENT_PICK, card_id, -taken[card_id], tcg_id, section_id)
+                for card_id, tcg_id, section_id, _, _ in remaining
+                if taken[card_id]
+            ],
+        )
+
+        section_ids = list(per_section)
+        for start in range(0, len(section_ids), PICK_QUERY_CHUNK):
+            counters.extend(
+                session.execute(
+                    select(Section.id, Section.card_count, Section.max_cards).where(
+                        Section.id.in_(section_ids[start : start + PICK_QUERY_CHUNK])
+                    )
+                )
+            )
+        with metrics.timer("remove_quantities.commit"):
+            session.commit()
+    except Exception as e:
+        logger.error(f"Failed to commit session: {e}")
+        session.rollback()
+        inventory_status.reset_caches()
+        raise
+
+    index = inventory_status.free_space_index(session)
+    for section_id, card_count, max_cards in counters:
+        index.update(section_id, card_count, max_cards)
+
+    skus = inventory_status.sku_index(session)
+    deleted = 0
+    for card_id, tcg_id, _, quantity, capacity in remaining:
+        entry = skus.get(tcg_id)
+        if quantity <= 0:
+            deleted += 1
+            if entry is not None and entry[0] == card_id:
+                del skus[tcg_id]
+        elif entry is not None and entry[0] == card_id:
+            entry[2] = capacity - quantity
+    inventory_status.last_removal_date = datetime.now()
+    return deleted
 
 
 def upload_from_csv(filepath, session, inventory_status):
@@ -325,21 +1200,22 @@ def upload_from_csv(filepath, session, inventory_status):
         for row in card_reader:
             row_count += 1
             try:
-                tcg_id = int(row["TCGplayer Id"])
-                card_name = row["Product Name"]
-                set_name = row["Set Name"]
-                quantity = int(row["Add to Quantity"])
-
-                print(f"{quantity} || {card_name} || {set_name} || {tcg_id},")
-
-                if insert_card(
-                    session, inventory_status, tcg_id, card_name, set_name, quantity
-                ):
+                with metrics.timer("upload.parse"):
+                    tcg_id = int(row["TCGplayer Id"])
+                    card_name = row["Product Name"]
+                    set_name = row["Set Name"]
+                    quantity = int(row["Add to Quantity"])
+
+                with metrics.timer("upload.insert_card"):
+                    inserted = insert_card(
+                        session, inventory_status, tcg_id, card_name, set_name, quantity
+                    )
+                if inserted:
                     success_count += 1
 
             except ValueError:
-                logger.warning(
-                    f"Invalid TCGplayer Id: {row['TCGplayer Id']}. Skipping row."
+                card_logger.warning(
+                    "Invalid TCGplayer Id: %s. Skipping row.", row["TCGplayer Id"]
                 )
                 continue
             except Exception as e:
@@ -349,6 +1225,540 @@ def upload_from_csv(filepath, session, inventory_status):
         session.commit()
 
 
+def parse_card_row(row):
+    """
+    (tcg_id, card_name, set_name, quantity) from a TCGplayer export row.
+    Raises ValueError when the id or quantity is not an integer.
+    """
+    return (
+        int(row["TCGplayer Id"]),
+        row["Product Name"],
+        row["Set Name"],
+        int(row["Add to Quantity"]),
+    )
+
+
+def parse_csv_lines(lines, fieldnames):
+    """
+    Parse raw CSV lines (without the header) into records.
+    Returns (records, invalid_ids) in input order.
+    """
+    records = []
+    invalid_ids = []
+    for row in csv.DictReader(lines, fieldnames=fieldnames):
+        try:
+            records.append(parse_card_row(row))
+        except ValueError:
+            invalid_ids.append(row["TCGplayer Id"])
+    return records, invalid_ids
+
+
+def parse_csv_rows(filepath):
+    """
+    Parse a TCGplayer export into (tcg_id, card_name, set_name, quantity) tuples.
+    Rows with a non-numeric id or quantity are skipped with a warning.
+    """
+    records = []
+    with open(filepath, "r") as csvfile:
+        card_reader = csv.DictReader(csvfile)
+        for row in card_reader:
+            try:
+                records.append(parse_card_row(row))
+            except ValueError:
+                card_logger.warning(
+                    "Invalid TCGplayer Id: %s. Skipping row.", row["TCGplayer Id"]
+                )
+    return records
+
+
+class PlacementPlan:
+    """
+    Output of plan_placements: new cards to insert, quantities to merge into
+    existing cards, and the section counters that result.
+    """
+
+    def __init__(self):
+        self.placements = []
+        self.merges = {}
+        self.merge_skus = {}
+        self.touched = {}
+        self.pending_skus = []
+        self.stored = 0
+
+    def touch(self, section_id, card_count, added):
+        state = self.touched.setdefault(section_id, [0, 0])
+        state[0] = card_count
+        state[1] += added
+
+
+def plan_placements(session, inventory_status, records):
+    """
+    Decide, in memory, what insert_card would do for each record: top up the
+    cached card for the SKU, then place any remainder as a new card. A
+    record whose remainder cannot fit in one section is skipped whole. New
+    boxes are opened (and flushed) when the free-space index runs dry.
+
+    placements holds [section_id, [tcg_id, card_name, set_name, quantity]]
+    entries, merges maps existing card_id -> quantity added (merge_skus
+    holds its (tcg_id, section_id)), and touched maps
+    section_id -> [card_count, quantity_added].
+    """
+    plan = PlacementPlan()
+    index = inventory_status.free_space_index(session)
+    skus = inventory_status.sku_index(session)
+
+    for tcg_id, card_name, set_name, quantity in records:
+        entry = skus.get(tcg_id)
+        merged = 0
+        if entry is not None and quantity > 0:
+            merged = min(quantity, merge_room(index, entry))
+        if quantity - merged > SECTION_CAPACITY:
+            card_logger.warning(
+                "Cannot store %s: %s cards do not fit in one section. Skipping row.",
+                card_name,
+                quantity - merged,
+                extra={"tcg_id": tcg_id},
+            )
+            continue
+
+        if merged > 0:
+            section_id = entry[1]
+            card_count, max_cards = index.counts(section_id)
+            index.update(section_id, card_count + merged, max_cards)
+            plan.touch(section_id, card_count + merged, merged)
+            entry[2] -= merged
+            if entry[0] is None:
+                plan.placements[entry[3]][1][3] += merged
+            else:
+                plan.merges[entry[0]] = plan.merges.get(entry[0], 0) + merged
+                plan.merge_skus[entry[0]] = (tcg_id, section_id)
+            quantity -= merged
+            if quantity == 0:
+                plan.stored += 1
+                continue
+
+        # choose_section only returns sections with room for quantity here.
+        section_id = choose_section(session, inventory_status, quantity, set_name)
+        card_count, max_cards = index.counts(section_id)
+        index.update(section_id, card_count + quantity, max_cards)
+        inventory_status.placement.placed(section_id, set_name)
+        plan.touch(section_id, card_count + quantity, quantity)
+        entry = [None, section_id, CARD_CAPACITY - quantity, len(plan.placements)]
+        skus[tcg_id] = entry
+        plan.pending_skus.append(entry)
+        plan.placements.append([section_id, [tcg_id, card_name, set_name, quantity]])
+        plan.stored += 1
+
+    return plan
+
+
+def write_plan(session, plan):
+    """
+    Apply a PlacementPlan inside the current transaction, locking in the
+    order apply_capacity_deltas describes: merged cards, then sections,
+    each with conditional UPDATEs in id order, then the rollups. The first
+    UPDATE also takes SQLite's write lock before new card ids are read back.
+    On PostgreSQL the ids are drawn from the sequence and the cards loaded
+    with COPY instead. Returns False, with nothing worth keeping written, if
+    another station claimed capacity the plan relied on; the caller rolls
+    back and replans.
+    """
+    cards, sections = Card.__table__, Section.__table__
+
+    events = []
+    if plan.merges:
+        result = session.execute(
+            cards.update()
+            .where(
+                cards.c.id == bindparam("_id"),
+                cards.c.section_id == bindparam("_section"),
+                cards.c.quantity + bindparam("_added") <= cards.c.capacity,
+            )
+            .values(quantity=cards.c.quantity + bindparam("_added")),
+            [
+                {
+                    "_id": card_id,
+                    "_section": plan.merge_skus[card_id][1],
+                    "_added": added,
+                }
+                for card_id, added in sorted(plan.merges.items())
+            ],
+        )
+        if result.rowcount != len(plan.merges):
+            return False
+        events = [
+            card_event(EVENT_INTAKE, card_id, added, *plan.merge_skus[card_id])
+            for card_id, added in sorted(plan.merges.items())
+        ]
+
+    if plan.touched:
+        result = session.execute(
+            sections.update()
+            .where(
+                sections.c.id == bindparam("_id"),
+                sections.c.card_count + bindparam("_added") <= sections.c.max_cards,
+            )
+            .values(
+                card_count=sections.c.card_count + bindparam("_added"),
+                current_quantity=sections.c.current_quantity + bindparam("_added"),
+            ),
+            [
+                {"_id": section_id, "_added": added}
+                for section_id, (_, added) in sorted(plan.touched.items())
+            ],
+        )
+        if result.rowcount != len(plan.touched):
+            return False
+        apply_capacity_deltas(
+            session, {section_id: added for section_id, (_, added) in plan.touched.items()}
+        )
+
+    if plan.placements:
+        rows = [
+            {
+                "section_id": section_id,
+                "tcg_id": tcg_id,
+                "card_name": card_name,
+                "set_name": set_name,
+                "quantity": quantity,
+            }
+            for section_id, (tcg_id, card_name, set_name, quantity) in plan.placements
+        ]
+        if is_postgresql(session):
+            new_ids = reserve_ids(session, cards, len(rows))
+            for card_id, row in zip(new_ids, rows):
+                row["id"] = card_id
+            copy_rows(session, cards, rows)
+        else:
+            last_card_id = session.execute(select(func.max(Card.id))).scalar() or 0
+            session.execute(cards.insert(), rows)
+            new_ids = (
+                session.execute(
+                    select(Card.id).where(Card.id > last_card_id).order_by(Card.id)
+                )
+                .scalars()
+                .all()
+            )
+        for entry in plan.pending_skus:
+            entry[0] = new_ids[entry.pop()]
+        events.extend(
+            card_event(
+                EVENT_INTAKE,
+                card_id,
+                quantity,
+                tcg_id,
+                section_id,
+                card_name=card_name,
+                set_name=set_name,
+            )
+            for card_id, (section_id, (tcg_id, card_name, set_name, quantity)) in zip(
+                new_ids, plan.placements
+            )
+        )
+
+    record_section_changes(session, list(plan.touched))
+    record_events(session, events)
+    return True
+
+
+def bulk_insert_records(
+    session, inventory_status, records, batch_size=5000, before_commit=None
+):
+    """
+    Place and write parsed records batch_size at a time, each batch as one
+    transaction of executemany statements (see write_plan). A batch that
+    loses a capacity race with another station is replanned against fresh
+    counters, up to ALLOCATION_RETRIES times. before_commit(session), if
+    given, runs inside each batch's transaction once its cards are written,
+    so anything it records commits (or rolls back) with them. Returns the
+    number of records stored.
+    """
+    stored = 0
+    last_section_id = None
+    try:
+        for start in range(0, len(records), batch_size):
+            batch = records[start : start + batch_size]
+            for _ in range(ALLOCATION_RETRIES):
+                with metrics.timer("bulk.plan"):
+                    plan = plan_placements(session, inventory_status, batch)
+                with metrics.timer("bulk.write"):
+                    written = write_plan(session, plan)
+                if written:
+                    if before_commit is not None:
+                        before_commit(session)
+                    with metrics.timer("bulk.commit"):
+                        session.commit()
+                    break
+                metrics.count("bulk.replans")
+                session.rollback()
+                inventory_status.reset_caches()
+                logger.warning("Section capacity changed during a batch; replanning")
+            else:
+                raise RuntimeError(
+                    f"Could not place batch after {ALLOCATION_RETRIES} attempts"
+                )
+            stored += plan.stored
+            if plan.placements:
+                last_section_id = plan.placements[-1][0]
+    except Exception as e:
+        logger.error(f"Failed to commit session: {e}")
+        session.rollback()
+        inventory_status.reset_caches()
+        raise
+
+    session.expire_all()
+    if last_section_id is not None:
+        inventory_status.update_after_insertion(
+            inventory_status.current_box,
+            inventory_status.current_row,
+            session.get(Section, last_section_id),
+        )
+    return stored
+
+
+def bulk_upload_from_csv(filepath, session, inventory_status, batch_size=5000):
+    """
+    Bulk counterpart to upload_from_csv. The whole file is parsed first,
+    then placed and written in batches by bulk_insert_records.
+    """
+    started = time.perf_counter()
+    with metrics.timer("bulk.parse"):
+        records = parse_csv_rows(filepath)
+    inserted = bulk_insert_records(session, inventory_status, records, batch_size)
+
+    elapsed = time.perf_counter() - started
+    rate = len(records) / elapsed if elapsed > 0 else float("inf")
+    logger.info(
+        f"Bulk loaded {inserted}/{len(records)} rows in {elapsed:.2f}s "
+        f"({rate:.0f} rows/sec)"
+    )
+    return {
+        "rows": len(records),
+        "inserted": inserted,
+        "seconds": elapsed,
+        "rows_per_sec": rate,
+    }
+
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def advance_journal(session, journal_id, byte_offset, row_number):
+    journal = IngestJournal.__table__
+    session.execute(
+        journal.update()
+        .where(journal.c.id == journal_id)
+        .values(byte_offset=byte_offset, row_number=row_number)
+    )
+
+
+def resumable_upload_from_csv(filepath, session, inventory_status, batch_size=5000):
+    """
+    Bulk upload that can be re-run after a crash. An ingest_journal row keyed
+    by the file hash records the byte offset and row number reached; it is
+    updated in the same commit as each batch, so a restart seeks straight to
+    the first uncommitted line and nothing is inserted twice. Like the
+    pipelined loader, this assumes no quoted field spans a newline.
+    """
+    file_hash = file_sha256(filepath)
+    journal = session.query(IngestJournal).filter_by(file_hash=file_hash).first()
+    if journal is None:
+        journal = IngestJournal(
+            file_hash=file_hash, filepath=filepath, byte_offset=0, row_number=0
+        )
+        session.add(journal)
+        session.commit()
+    if journal.completed:
+        logger.info(f"{filepath} was already ingested. Skipping.")
+        return {"rows": 0, "inserted": 0, "resumed_at_row": journal.row_number}
+
+    journal_id = journal.id
+    resumed_at_row = row_number = journal.row_number
+    if resumed_at_row:
+        logger.info(f"Resuming {filepath} at row {resumed_at_row}")
+
+    inserted = 0
+    with open(filepath, "rb") as f:
+        header = f.readline().decode("utf-8-sig")
+        fieldnames = next(csv.reader([header]))
+        f.seek(max(journal.byte_offset, f.tell()))
+        while True:
+            lines = []
+            for line in f:
+                lines.append(line.decode("utf-8"))
+                if len(lines) >= batch_size:
+                    break
+            if not lines:
+                break
+
+            records, invalid_ids = parse_csv_lines(lines, fieldnames)
+            for tcg_id in invalid_ids:
+                card_logger.warning("Invalid TCGplayer Id: %s. Skipping row.", tcg_id)
+
+            byte_offset = f.tell()
+            row_number += len(lines)
+            if not records:
+                advance_journal(session, journal_id, byte_offset, row_number)
+                session.commit()
+                continue
+            inserted += bulk_insert_records(
+                session,
+                inventory_status,
+                records,
+                batch_size=max(len(records), 1),
+                before_commit=lambda session: advance_journal(
+                    session, journal_id, byte_offset, row_number
+                ),
+            )
+
+    journal.completed = True
+    session.commit()
+    return {
+        "rows": row_number - resumed_at_row,
+        "inserted": inserted,
+        "resumed_at_row": resumed_at_row,
+    }
+
+
+def ensure_indexes(bind):
+    """
+    create_all skips tables that already exist, so indexes added to the
+    models later are created here for older database files, and indexes
+    they replaced are dropped.
+    """
+    if isinstance(bind, Engine):
+        with bind.begin() as connection:
+            return ensure_indexes(connection)
+    for name in SUPERSEDED_INDEXES:
+        bind.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+
+def ensure_rollups(bind):
+    """
+    Add the rollup columns (Row and Box free_capacity, Box quantity) to
+    database files created before they existed and, if anything was
+    missing, backfill the rollups from the section counters. Drops the
+    inventory_totals table that older files kept before the Box rollups
+    replaced it.
+    """
+    if isinstance(bind, Engine):
+        with bind.begin() as connection:
+            return ensure_rollups(connection)
+    inspector = inspect(bind)
+    backfill = False
+    for table, column_name in (
+        (Row.__table__, "free_capacity"),
+        (Box.__table__, "free_capacity"),
+        (Box.__table__, "quantity"),
+    ):
+        if column_name not in {
+            column["name"] for column in inspector.get_columns(table.name)
+        }:
+            bind.execute(
+                text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column_name} INTEGER DEFAULT 0"
+                )
+            )
+            backfill = True
+    if backfill:
+        recompute_rollups(bind)
+    bind.execute(text("DROP TABLE IF EXISTS inventory_totals"))
+
+
+def ensure_event_log(bind):
+    """
+    Seed the event log of a database that holds cards but no events yet
+    with one intake event per card, so replaying the log reproduces the
+    stock that existed before events were recorded.
+    """
+    if isinstance(bind, Engine):
+        with bind.begin() as connection:
+            return ensure_event_log(connection)
+    if bind.execute(select(InventoryEvent.id).limit(1)).first() is not None:
+        return
+    bind.execute(
+        InventoryEvent.__table__.insert().from_select(
+            [
+                "kind",
+                "card_id",
+                "tcg_id",
+                "section_id",
+                "quantity",
+                "card_name",
+                "set_name",
+                "created_at",
+            ],
+            select(
+                literal(EVENT_INTAKE),
+                Card.id,
+                Card.tcg_id,
+                Card.section_id,
+                Card.quantity,
+                Card.card_name,
+                Card.set_name,
+                literal(datetime.now()),
+            ).order_by(Card.id),
+        )
+    )
+
+
+def hot_queries():
+    """
+    Representative statements for every lookup on the insert/pick/export paths.
+    """
+    return {
+        "card by tcg_id": select(Card).where(Card.tcg_id == 1),
+        "cards in section": select(Card).where(Card.section_id == 1),
+        "sections in row": select(Section).where(Section.row_id == 1),
+        "rows in box": select(Row).where(Row.box_id == 1),
+        "free sections": select(Section.id, Section.card_count, Section.max_cards)
+        .join(Row, Section.row_id == Row.id)
+        .join(Box, Row.box_id == Box.id)
+        .where(
+            Box.free_capacity > 0,
+            Row.free_capacity > 0,
+            Section.card_count < Section.max_cards,
+        ),
+        "card locations": select(Box.id, Row.id, Section.id, Card.id)
+        .join(Row, Row.box_id == Box.id)
+        .join(Section, Section.row_id == Row.id)
+        .join(Card, Card.section_id == Section.id)
+        .where(Card.tcg_id.in_([1, 2, 3])),
+    }
+
+
+def explain_hot_queries(engine):
+    """
+    Print SQLite's EXPLAIN QUERY PLAN (PostgreSQL's EXPLAIN) for each hot
+    query. A "SCAN" (or "Seq Scan") line on one of these usually means an
+    index went missing.
+    """
+    plans = {}
+    explain = "EXPLAIN" if is_postgresql(engine) else "EXPLAIN QUERY PLAN"
+    with engine.connect() as connection:
+        for name, statement in hot_queries().items():
+            sql = str(
+                statement.compile(engine, compile_kwargs={"literal_binds": True})
+            )
+            plan = [
+                row[-1]
+                for row in connection.execute(text(f"{explain} {sql}"))
+            ]
+            plans[name] = plan
+            print(f"{name}:")
+            for step in plan:
+                print(f"    {step}")
+    return plans
+
+
 def convert_windows_path_to_wsl(path):
     try:
         path = path.replace("\\", "/")
@@ -360,36 +1770,191 @@ def convert_windows_path_to_wsl(path):
     except Exception as e:
         raise ValueError(f"An error occurred while converting the path: {e}")
 
-def generate_inventory(session: Session):
-        boxes = session.query(Box).all()
-        inventory = {"Inventory": [box.to_dict() for box in boxes]}
+def _indent(level):
+    return " " * 4 * level
+
 
-        with open('inventory.json', 'w') as f:
-            json.dump(inventory, f, indent=4)
+def iter_inventory_json(session: Session, chunk_size=1000):
+    """
+    Yield the inventory.json document in pieces, in the same layout as
+    json.dump(indent=4) of the nested Box.to_dict() tree. Boxes, rows,
+    sections and cards come from one ordered outer-joined query that is
+    streamed chunk_size rows at a time, so only one section is held in memory.
+    """
+    statement = (
+        select(
+            Box.id,
+            Row.id,
+            Section.id,
+            Section.card_count,
+            Section.current_quantity,
+            Card.tcg_id,
+            Card.card_name,
+            Card.set_name,
+            Card.quantity,
+        )
+        .select_from(Box)
+        .outerjoin(Row, Row.box_id == Box.id)
+        .outerjoin(Section, Section.row_id == Row.id)
+        .outerjoin(Card, Card.section_id == Section.id)
+        .order_by(Box.id, Row.id, Section.id, Card.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    result = session.execute(statement)
+
+    yield '{\n    "Inventory": ['
+    wrote_box = False
+    for _, box_records in groupby(result, key=itemgetter(0)):
+        yield ("," if wrote_box else "") + f'\n{_indent(2)}{{\n{_indent(3)}"rows": ['
+        wrote_box = True
+        wrote_row = False
+        for row_id, row_records in groupby(box_records, key=itemgetter(1)):
+            if row_id is None:
+                continue
+            yield ("," if wrote_row else "") + (
+                f'\n{_indent(4)}{{\n{_indent(5)}"sections": ['
+            )
+            wrote_row = True
+            wrote_section = False
+            for section_id, section_records in groupby(row_records, key=itemgetter(2)):
+                if section_id is None:
+                    continue
+                records = list(section_records)
+                section = {
+                    "card_count": records[0][3],
+                    "current_quantity": records[0][4],
+                    "cards": [
+                        {
+                            "TCGplayer Id": record[5],
+                            "Product Name": record[6],
+                            "Set Name": record[7],
+                            "Add to Quantity": record[8],
+                        }
+                        for record in records
+                        if record[5] is not None
+                    ],
+                }
+                chunk = json.dumps(section, indent=4).replace("\n", "\n" + _indent(6))
+                yield ("," if wrote_section else "") + "\n" + _indent(6) + chunk
+                wrote_section = True
+            yield (f"\n{_indent(5)}]" if wrote_section else "]") + f"\n{_indent(4)}}}"
+        yield (f"\n{_indent(3)}]" if wrote_row else "]") + f"\n{_indent(2)}}}"
+    yield (f"\n{_indent(1)}]" if wrote_box else "]") + "\n}"
+
+
+def generate_inventory(session: Session, path="inventory.json"):
+    chunks = iter_inventory_json(session)
+    with metrics.timer("generate_inventory"), open(path, "w") as f:
+        while True:
+            with metrics.timer("generate_inventory.render"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with metrics.timer("generate_inventory.write"):
+                f.write(chunk)
+            metrics.count("generate_inventory.bytes", len(chunk))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Upload CSV to database")
-    parser.add_argument("filepath", type=str, help="")
-    inventory_status = InventoryStatus()
+    parser.add_argument("filepath", type=str, nargs="?", help="")
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="plan placements in memory and write cards in batched transactions",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="bulk upload with an ingest journal so a crashed run can be resumed",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=5000, help="cards per bulk commit"
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(SQLITE_PROFILES),
+        default="interactive",
+        help="SQLite PRAGMA profile for the database connection",
+    )
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get(DATABASE_URL_ENV),
+        help="SQLite or PostgreSQL URL (default: the local mtg_inventory.db)",
+    )
+    parser.add_argument(
+        "--pool-size", type=int, default=None, help="connection pool size (PostgreSQL)"
+    )
+    parser.add_argument(
+        "--max-overflow",
+        type=int,
+        default=None,
+        help="connections allowed beyond the pool size (PostgreSQL)",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="print EXPLAIN QUERY PLAN for the hot queries and exit",
+    )
+    parser.add_argument(
+        "--placement",
+        choices=sorted(PLACEMENT_STRATEGIES),
+        default="empty-section",
+        help="how new cards are assigned to sections",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="time each intake stage and write the results to PATH "
+        "(Prometheus text for .prom, a JSON summary otherwise)",
+    )
+    add_logging_arguments(parser)
     args = parser.parse_args()
-
-    engine = create_engine("sqlite:///mtg_inventory.db")
+    configure_from_args(args)
+    if args.metrics:
+        metrics.enable()
+    inventory_status = InventoryStatus(placement=args.placement)
+    if not args.filepath and not args.explain:
+        parser.error("filepath is required unless --explain is given")
+
+    engine = create_inventory_engine(
+        args.database_url,
+        profile=args.profile,
+        pool={"pool_size": args.pool_size, "max_overflow": args.max_overflow},
+    )
     Session = sessionmaker(bind=engine)
     Base.metadata.create_all(engine)
+    ensure_indexes(engine)
+    ensure_rollups(engine)
+    ensure_event_log(engine)
     session = Session()
 
+    if args.explain:
+        explain_hot_queries(engine)
+        raise SystemExit(0)
+
     first_box = session.query(Box).first()
     if not first_box:
-        new_box = Box()
-        session.add(new_box)
+        create_box(session)
         session.commit()
 
-    with engine.connect() as connection:
-        result = connection.execute(text("SELECT * FROM cards"))
-        for row in result:
-            print(row)
+    if card_logger.isEnabledFor(logging.DEBUG):
+        with engine.connect() as connection:
+            for row in connection.execute(text("SELECT * FROM cards")):
+                card_logger.debug("%s", row)
 
     generate_inventory(session)
 
-    upload_from_csv(args.filepath, session, inventory_status)
\ No newline at end of file
+    if args.resume:
+        resumable_upload_from_csv(
+            args.filepath, session, inventory_status, batch_size=args.batch_size
+        )
+    elif args.bulk:
+        bulk_upload_from_csv(
+            args.filepath, session, inventory_status, batch_size=args.batch_size
+        )
+    else:
+        upload_from_csv(args.filepath, session, inventory_status)
+
+    if args.metrics:
+        metrics.write(args.metrics)
\ No newline at end of file
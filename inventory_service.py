@@ -0,0 +1,311 @@
+import argparse
+import asyncio
+import os
+import tempfile
+
+from aiohttp import web
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from db_engine import (
+    DATABASE_URL_ENV,
+    SQLITE_PROFILES,
+    apply_sqlite_profile,
+    database_url,
+    pool_settings,
+)
+from inv_manager import (
+    Base,
+    Card,
+    InventoryStatus,
+    ensure_event_log,
+    ensure_indexes,
+    ensure_rollups,
+    generate_inventory,
+    insert_card,
+    inventory_totals,
+    logger,
+    remove_cards,
+    remove_quantities,
+    resolve_pick_list,
+)
+from log_config import add_logging_arguments, configure_from_args
+from metrics import metrics
+from placement import PLACEMENT_STRATEGIES
+
+DEFAULT_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///mtg_inventory.db"
+EXPORT_CHUNK = 64 * 1024
+
+
+def create_async_inventory_engine(
+    url=DEFAULT_ASYNC_DATABASE_URL, profile="interactive", pool=None, **pragmas
+):
+    """
+    Async counterpart of db_engine.create_inventory_engine.
+    """
+    url = database_url(url, asynchronous=True)
+    if url.get_backend_name() == "sqlite":
+        engine = create_async_engine(url)
+        apply_sqlite_profile(engine.sync_engine, profile, **pragmas)
+    else:
+        engine = create_async_engine(url, **pool_settings(**(pool or {})))
+    return engine
+
+
+class InventoryService:
+    """
+    Long-running owner of the inventory. One InventoryStatus (free-space
+    index and tcg_id cache) stays warm across requests; the existing sync
+    operations run on AsyncSession.run_sync. Writes are serialized by a lock
+    since they share those caches and SQLite has a single writer; lookups
+    run concurrently.
+    """
+
+    def __init__(self, engine, export_path="inventory.json", placement="empty-section"):
+        self.engine = engine
+        self.sessionmaker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=True
+        )
+        self.export_path = export_path
+        self.inventory_status = InventoryStatus(placement=placement)
+        self.write_lock = asyncio.Lock()
+        self.export_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+            await connection.run_sync(ensure_indexes)
+            await connection.run_sync(ensure_rollups)
+            await connection.run_sync(ensure_event_log)
+        async with self.sessionmaker() as session:
+            await session.run_sync(self._warm_caches)
+
+    async def close(self):
+        await self.engine.dispose()
+
+    def _warm_caches(self, session):
+        self.inventory_status.free_space_index(session)
+        self.inventory_status.sku_index(session)
+
+    async def insert(self, tcg_id, card_name, set_name, quantity):
+        async with self.write_lock, self.sessionmaker() as session:
+            return await session.run_sync(
+                lambda sync_session: insert_card(
+                    sync_session,
+                    self.inventory_status,
+                    tcg_id,
+                    card_name,
+                    set_name,
+                    quantity,
+                )
+            )
+
+    async def locate(self, order_lines):
+        async with self.sessionmaker() as session:
+            return await session.run_sync(resolve_pick_list, order_lines)
+
+    def _pick(self, session, order_lines):
+        resolved = resolve_pick_list(session, order_lines)
+        remove_quantities(
+            session, self.inventory_status, [pick for picks in resolved for pick in picks]
+        )
+        return resolved
+
+    async def pick(self, order_lines):
+        async with self.write_lock, self.sessionmaker() as session:
+            return await session.run_sync(self._pick, order_lines)
+
+    def _remove(self, session, card_ids):
+        cards = session.query(Card).filter(Card.id.in_(card_ids)).all()
+        remove_cards(session, self.inventory_status, cards)
+        return len(cards)
+
+    async def remove(self, card_ids):
+        async with self.write_lock, self.sessionmaker() as session:
+            return await session.run_sync(self._remove, card_ids)
+
+    def _export(self, session):
+        directory = os.path.dirname(os.path.abspath(self.export_path))
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        os.close(fd)
+        try:
+            generate_inventory(session, temp_path)
+            os.replace(temp_path, self.export_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    async def export(self):
+        """
+        Regenerate export_path and return it opened for reading. Each export
+        is written to a temp file and moved into place, so the handle keeps
+        reading this request's document while later exports replace the file.
+        """
+        async with self.export_lock, self.sessionmaker() as session:
+            await session.run_sync(self._export)
+            return open(self.export_path, "rb")
+
+    async def totals(self):
+        async with self.sessionmaker() as session:
+            return await session.run_sync(inventory_totals)
+
+    def status(self):
+        free_space = self.inventory_status.free_space
+        skus = self.inventory_status.sku_cache
+        return {
+            "indexed_sections": len(free_space) if free_space is not None else 0,
+            "free_capacity": free_space.free_capacity() if free_space is not None else 0,
+            "cached_skus": len(skus) if skus is not None else 0,
+        }
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+
+
+def _order_lines(body):
+    try:
+        return [(int(line["tcg_id"]), int(line["quantity"])) for line in body["lines"]]
+    except (KeyError, TypeError, ValueError):
+        raise web.HTTPBadRequest(
+            text='Expected {"lines": [{"tcg_id": ..., "quantity": ...}]}'
+        )
+
+
+async def handle_insert(request):
+    body = await _json_body(request)
+    try:
+        card = (
+            int(body["tcg_id"]),
+            body["card_name"],
+            body["set_name"],
+            int(body["quantity"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        raise web.HTTPBadRequest(
+            text="Expected tcg_id, card_name, set_name and quantity"
+        )
+    inserted = await request.app["service"].insert(*card)
+    return web.json_response({"inserted": bool(inserted)})
+
+
+def _lines_response(order_lines, resolved):
+    return web.json_response(
+        {
+            "lines": [
+                {"tcg_id": tcg_id, "quantity": quantity, "picks": picks}
+                for (tcg_id, quantity), picks in zip(order_lines, resolved)
+            ]
+        }
+    )
+
+
+async def handle_locate(request):
+    order_lines = _order_lines(await _json_body(request))
+    return _lines_response(order_lines, await request.app["service"].locate(order_lines))
+
+
+async def handle_pick(request):
+    order_lines = _order_lines(await _json_body(request))
+    return _lines_response(order_lines, await request.app["service"].pick(order_lines))
+
+
+async def handle_remove(request):
+    body = await _json_body(request)
+    try:
+        card_ids = [int(card_id) for card_id in body["card_ids"]]
+    except (KeyError, TypeError, ValueError):
+        raise web.HTTPBadRequest(text='Expected {"card_ids": [...]}')
+    removed = await request.app["service"].remove(card_ids)
+    return web.json_response({"removed": removed})
+
+
+async def handle_export(request):
+    with await request.app["service"].export() as f:
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        response.content_length = os.fstat(f.fileno()).st_size
+        await response.prepare(request)
+        for chunk in iter(lambda: f.read(EXPORT_CHUNK), b""):
+            await response.write(chunk)
+        await response.write_eof()
+    return response
+
+
+async def handle_status(request):
+    return web.json_response(request.app["service"].status())
+
+
+async def handle_totals(request):
+    return web.json_response(await request.app["service"].totals())
+
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.prometheus_text(), content_type="text/plain")
+
+
+def create_app(service):
+    app = web.Application()
+    app["service"] = service
+    app.router.add_post("/cards", handle_insert)
+    app.router.add_post("/cards/remove", handle_remove)
+    app.router.add_post("/locate", handle_locate)
+    app.router.add_post("/pick", handle_pick)
+    app.router.add_get("/export", handle_export)
+    app.router.add_get("/status", handle_status)
+    app.router.add_get("/totals", handle_totals)
+    app.router.add_get("/metrics", handle_metrics)
+
+    async def on_startup(app):
+        await service.start()
+        logger.info(f"Inventory service ready: {service.status()}")
+
+    async def on_cleanup(app):
+        await service.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inventory HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get(DATABASE_URL_ENV, DEFAULT_ASYNC_DATABASE_URL),
+        help="SQLite or PostgreSQL URL; sync drivers are swapped for async ones",
+    )
+    parser.add_argument("--pool-size", type=int, default=None)
+    parser.add_argument("--max-overflow", type=int, default=None)
+    parser.add_argument(
+        "--profile", choices=sorted(SQLITE_PROFILES), default="interactive"
+    )
+    parser.add_argument("--export-path", default="inventory.json")
+    parser.add_argument(
+        "--placement", choices=sorted(PLACEMENT_STRATEGIES), default="empty-section"
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="time the hot paths and serve them at GET /metrics",
+    )
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.metrics:
+        metrics.enable()
+
+    engine = create_async_inventory_engine(
+        args.database_url,
+        profile=args.profile,
+        pool={"pool_size": args.pool_size, "max_overflow": args.max_overflow},
+    )
+    web.run_app(
+        create_app(InventoryService(engine, args.export_path, args.placement)),
+        host=args.host,
+        port=args.port,
+    )
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+from termcolor import colored
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+LOG_FORMATS = ["color", "plain", "json"]
+
+# Attributes every LogRecord carries; anything else came in through extra=.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+_settings = {
+    "level": os.environ.get("INVENTORY_LOG_LEVEL", "INFO").upper(),
+    "format": os.environ.get("INVENTORY_LOG_FORMAT")
+    or ("color" if sys.stderr.isatty() else "plain"),
+    "sample": int(os.environ.get("INVENTORY_LOG_SAMPLE", "1")),
+}
+_loggers = []
+_samplers = []
+
+
+class ColoredFormatter(logging.Formatter):
+    COLORS = {
+        "WARNING": "yellow",
+        "INFO": "green",
+        "DEBUG": "blue",
+        "CRITICAL": "red",
+        "ERROR": "red",
+    }
+
+    def format(self, record):
+        log_message = super(ColoredFormatter, self).format(record)
+        return colored(log_message, self.COLORS.get(record.levelname))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger and message, plus any
+    fields passed with extra=.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Let one in every `every` records through. Warnings and above always pass.
+    """
+
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = every
+        self.seen = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.every <= 1:
+            return True
+        self.seen += 1
+        return self.seen % self.every == 1
+
+
+def _formatter(name):
+    if name == "json":
+        return JsonFormatter()
+    if name == "color":
+        return ColoredFormatter("[%(levelname)s] - %(message)s")
+    return logging.Formatter("[%(levelname)s] - %(message)s")
+
+
+def get_logger(name):
+    """
+    A module logger with its own stderr handler, following the level and
+    format set by configure_logging (or the INVENTORY_LOG_* variables).
+    """
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    handler = logging.StreamHandler()
+    handler.setFormatter(_formatter(_settings["format"]))
+    logger.addHandler(handler)
+    logger.setLevel(_settings["level"])
+    _loggers.append(logger)
+    return logger
+
+
+def get_sampled_logger(parent, suffix="cards"):
+    """
+    Child of parent for per-row events, thinned out by --log-sample.
+    Records go to the parent's handlers at the parent's level.
+    """
+    logger = logging.getLogger(f"{parent.name}.{suffix}")
+    sampler = SampleFilter(_settings["sample"])
+    logger.addFilter(sampler)
+    _samplers.append(sampler)
+    return logger
+
+
+def configure_logging(level=None, fmt=None, sample=None):
+    if level is not None:
+        _settings["level"] = level.upper()
+    if fmt is not None:
+        _settings["format"] = fmt
+    if sample is not None:
+        _settings["sample"] = sample
+    for logger in _loggers:
+        logger.setLevel(_settings["level"])
+        for handler in logger.handlers:
+            handler.setFormatter(_formatter(_settings["format"]))
+    for sampler in _samplers:
+        sampler.every = _settings["sample"]
+        sampler.seen = 0
+
+
+def add_logging_arguments(parser):
+    parser.add_argument(
+        "--log-level",
+        type=str.upper,
+        choices=LOG_LEVELS,
+        default=None,
+        help="log threshold (default INVENTORY_LOG_LEVEL or INFO)",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS,
+        default=None,
+        help="colored or plain text, or JSON lines (default INVENTORY_LOG_FORMAT)",
+    )
+    parser.add_argument(
+        "--log-sample",
+        type=int,
+        default=None,
+        metavar="N",
+        help="keep one in N per-card log records (default INVENTORY_LOG_SAMPLE or 1)",
+    )
+
+
+def configure_from_args(args):
+    configure_logging(args.log_level, args.log_format, args.log_sample)
@@ -0,0 +1,162 @@
+import bisect
+import json
+import os
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets.
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    float("inf"),
+)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-th observation.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    Stage timers (latency histograms) and counters for the hot paths.
+    Disabled, timer() hands back one shared no-op context manager and
+    count() returns at once, so instrumented code pays a method call.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def timer(self, stage):
+        if not self.enabled:
+            return _NULL_TIMER
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        return _Timer(histogram)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        return {
+            "stages": {
+                stage: {
+                    "count": histogram.count,
+                    "total_seconds": histogram.sum,
+                    "mean_seconds": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "p50_seconds": histogram.quantile(0.5),
+                    "p99_seconds": histogram.quantile(0.99),
+                    "max_seconds": histogram.max,
+                }
+                for stage, histogram in sorted(self.histograms.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP inventory_stage_seconds Time spent in each instrumented stage.",
+            "# TYPE inventory_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'inventory_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}'
+                )
+            lines.append(f'inventory_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'inventory_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines.append("# HELP inventory_events_total Counted events on the hot paths.")
+        lines.append("# TYPE inventory_events_total counter")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'inventory_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write Prometheus text for .prom paths, a JSON summary otherwise.
+        """
+        with open(path, "w") as f:
+            if path.endswith(".prom"):
+                f.write(self.prometheus_text())
+            else:
+                json.dump(self.summary(), f, indent=4)
+
+
+metrics = Metrics(enabled=os.environ.get("INVENTORY_METRICS", "") not in ("", "0"))
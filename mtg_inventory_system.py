@@ -1,36 +1,18 @@
 import os
 import csv
-import logging
-from termcolor import colored
 from sqlalchemy import (
-    Column, ForeignKey, Integer, 
-    String, text, create_engine)
+    Column, ForeignKey, Index, Integer, 
+    String, bindparam, select, text)
 from sqlalchemy.orm import (
     declarative_base, joinedload, 
     relationship, sessionmaker)
 
-class ColoredFormatter(logging.Formatter):
-    COLORS = {
-        'WARNING': 'yellow',
-        'INFO': 'green',
-        'DEBUG': 'blue',
-        'CRITICAL': 'red',
-        'ERROR': 'red'
-    }
+from db_engine import create_inventory_engine
+from log_config import get_logger, get_sampled_logger
+from metrics import metrics
 
-    def format(self, record):
-        log_message = super(ColoredFormatter, self).format(record)
-        return colored(log_message, self.COLORS.get(record.levelname))
-
-logger = logging.getLogger(__name__)
-logger.propagate = False
-
-handler = logging.StreamHandler()
-formatter = ColoredFormatter("[%(levelname)s] - %(message)s")
-handler.setFormatter(formatter)
-
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
+logger = get_logger(__name__)
+card_logger = get_sampled_logger(logger)
 
 Base = declarative_base()
 
@@ -43,8 +25,8 @@ class Card(Base):
     __tablename__ = 'cards'
 
     id = Column(Integer, primary_key=True)
-    section_id = Column(Integer, ForeignKey('sections.id'))
-    tcg_id = Column(Integer, nullable=False)
+    section_id = Column(Integer, ForeignKey('sections.id'), index=True)
+    tcg_id = Column(Integer, nullable=False, index=True)
     card_name = Column(String)
     set_name = Column(String)
     quantity = Column(Integer, default=0)
@@ -58,11 +40,13 @@ class Section(Base):
     __tablename__ = 'sections'
     
     id = Column(Integer, primary_key=True)
-    row_id = Column(Integer, ForeignKey('rows.id'))
+    row_id = Column(Integer, ForeignKey('rows.id'), index=True)
     card_count = Column(Integer, default=0)
+    current_quantity = Column(Integer, default=0)
     max_card_quantity = Column(Integer, default=100)
 
     row = relationship("Row", back_populates="sections")
+    cards = relationship("Card", back_populates="sleeve")
 
     def add_sleeve(self, sleeve):
         if self.sleeve_count < self.max_sleeves:
@@ -71,6 +55,13 @@ class Section(Base):
             return True
         return False
 
+# Partial index over sections with room; find_available_section still reads
+# the full rows it points to.
+Index('ix_mtg_sections_open',
+      Section.current_quantity, Section.max_card_quantity,
+      sqlite_where=Section.current_quantity < Section.max_card_quantity,
+      postgresql_where=Section.current_quantity < Section.max_card_quantity)
+
 class Row(Base):
     """
     Fourth layer of system
@@ -80,7 +71,7 @@ class Row(Base):
     __tablename__ = 'rows'
     
     id = Column(Integer, primary_key=True)
-    box_id = Column(Integer, ForeignKey('boxes.id'))
+    box_id = Column(Integer, ForeignKey('boxes.id'), index=True)
     section_count = Column(Integer, default=0)
     max_sections = Column(Integer, default=10)
 
@@ -123,6 +114,9 @@ MAX_SECTION_CARDS = 100  # Maximum cards a section can hold
 MAX_ROW_CARDS = 1000  # Maximum cards a row can hold (or 10 full sections)
 MAX_ROW_SECTIONS = 10  # Maximum sections a row can hold
 MAX_BOX_ROWS = 5  # Maximum rows a box can hold
+COLUMNS_PER_SHELF = 4  # mirrors calculate_box_location
+SHELF_STEP_COST = 0.25  # reaching another shelf, relative to walking one column
+ORDER_QUERY_CHUNK = 500  # tcg_ids per IN list, well under SQLite's bound-parameter limit
 
 
 def calculate_box_location(total_boxes):
@@ -139,6 +133,73 @@ def calculate_box_location(total_boxes):
 
     return rack_number, shelf_number, column_number, box_number
 
+def parse_location(location):
+    box_id, row_id, section_id = (int(part) for part in location.split('.'))
+    return box_id, row_id, section_id
+
+def box_position(box_id):
+    """
+    Physical (rack, shelf, column, box) of a box; box ids start at 1.
+    """
+    return calculate_box_location(box_id - 1)
+
+def aisle_cost(a, b):
+    """
+    Columns walked along the aisle between two box positions,
+    plus a small penalty for changing shelf.
+    """
+    rack_a, shelf_a, column_a, _ = a
+    rack_b, shelf_b, column_b, _ = b
+    x_a = (rack_a - 1) * COLUMNS_PER_SHELF + column_a
+    x_b = (rack_b - 1) * COLUMNS_PER_SHELF + column_b
+    return abs(x_a - x_b) + SHELF_STEP_COST * abs(shelf_a - shelf_b)
+
+def serpentine_key(position):
+    """
+    Zig-zag walk: straight down the aisle column by column, working the
+    shelves top-down in one column and bottom-up in the next.
+    """
+    rack, shelf, column, box = position
+    if column % 2 == 0:
+        shelf = -shelf
+    return rack, column, shelf, box
+
+def route_cost(positions, cost_model=aisle_cost, start=(1, 1, 1, 1)):
+    total = 0
+    current = start
+    for position in positions:
+        total += cost_model(current, position)
+        current = position
+    return total
+
+def order_pick_route(stops, cost_model=None, start=(1, 1, 1, 1)):
+    """
+    Sort pick stops (dicts with a "box.row.section" 'Location') into a walking route.
+    Boxes are visited in serpentine order, or nearest-first when a
+    cost_model(a, b) over (rack, shelf, column, box) positions is given.
+    Within a box, stops go by row then section.
+    """
+    by_box = {}
+    for stop in stops:
+        box_id, row_id, section_id = parse_location(stop['Location'])
+        by_box.setdefault(box_position(box_id), []).append(((row_id, section_id), stop))
+
+    if cost_model is None:
+        box_order = sorted(by_box, key=serpentine_key)
+    else:
+        box_order = []
+        remaining = set(by_box)
+        current = start
+        while remaining:
+            current = min(remaining, key=lambda p: (cost_model(current, p), serpentine_key(p)))
+            remaining.remove(current)
+            box_order.append(current)
+
+    route = []
+    for position in box_order:
+        route.extend(stop for _, stop in sorted(by_box[position], key=lambda item: item[0]))
+    return route
+
 def add_card_to_section(session, section, card):
     if section.card_count >= MAX_SECTION_CARDS:
         return False
@@ -191,6 +252,7 @@ def add_card_to_section(session, section, tcg_id, card_name, set_name, quantity)
 
 def find_available_section(session):
     return session.query(Section).filter(
+        Section.current_quantity < Section.max_card_quantity,
         Section.current_quantity + 1 <= MAX_SECTION_CARDS
     ).first()
 
@@ -253,34 +315,45 @@ def upload_from_csv(filename, session):
                 set_name = row['Set Name']
                 quantity = int(row['Add to Quantity'])
 
-                print(f"TCG ID: {tcg_id}, Name: {card_name}, Set: {set_name}, Quantity: {quantity} added to database")
+                card_logger.debug('TCG ID: %s, Name: %s, Set: %s, Quantity: %s added to database',
+                                  tcg_id, card_name, set_name, quantity)
                 insert_card(session, tcg_id, card_name, set_name, quantity)
                 session.commit()
             except ValueError:
-                logger.warning(f"Invalid TCGplayer Id: {row['TCGplayer Id']}. Skipping row.")
+                card_logger.warning('Invalid TCGplayer Id: %s. Skipping row.', row['TCGplayer Id'])
                 continue
 
-def match_order_from_csv(filename, session):
-    to_remove_list = []
-    output = []
-
+def read_order_lines(filename):
+    order_lines = []
     with open(filename, 'r') as csvfile:
         card_reader = csv.DictReader(csvfile)
         for row in card_reader:
             try:
-                tcg_id = int(row['TCGplayer Id'])
-                card_name = row['Product Name']
-                set_name = row['Set Name']
-                quantity = int(row['Add to Quantity'])
-                locations, cards_to_remove = find_card_location(session, tcg_id, quantity)
-                if locations:
-                    to_remove_list.extend(cards_to_remove)
-                    output.append({"TCGplayer Id": tcg_id, "Product Name": card_name, "Set Name": set_name, "Quantity": quantity, "Locations": locations})
-
+                order_lines.append({
+                    "TCGplayer Id": int(row['TCGplayer Id']),
+                    "Product Name": row['Product Name'],
+                    "Set Name": row['Set Name'],
+                    "Quantity": int(row['Add to Quantity'])})
             except ValueError:
-                print(f"Skipping row with invalid TCGplayer Id: {row['TCGplayer Id']}")
-                continue 
+                card_logger.warning('Skipping row with invalid TCGplayer Id: %s', row['TCGplayer Id'])
+                continue
+    return order_lines
+
+def match_order_from_csv(filename, session, cost_model=None):
+    to_remove_list = []
+    output = []
+
+    order_lines = read_order_lines(filename)
+    resolved, by_location = resolve_order(
+        session, [(line["TCGplayer Id"], line["Quantity"]) for line in order_lines])
+
+    for line, (locations, cards_to_remove) in zip(order_lines, resolved):
+        if locations:
+            to_remove_list.extend(cards_to_remove)
+            for location in locations:
+                output.append({**line, "Quantity": location['Card Count'], "Location": location['Location']})
     remove_cards(session, to_remove_list)
+    output = order_pick_route(output, cost_model)
 
     if output:
         keys = output[0].keys()
@@ -295,54 +368,145 @@ def match_order_from_csv(filename, session):
 
         with open(log_filename, 'a') as log_file:
             for item in output:
-                log_file.write(f"Removed card with TCG Id: {item['TCGplayer Id']}, Location: {item['Locations']}\n")
+                log_file.write(f"Removed card with TCG Id: {item['TCGplayer Id']}, Location: {item['Location']}\n")
     else:
-        print("No valid output to save.")
+        logger.info('No valid output to save.')
 
-def find_card_location(session, tcg_id, needed_quantity):
-    locations_with_counts = []
-    cards_to_remove = []
+    return by_location
 
-    query_result = session.query(Box, Row, Section, Card).filter(
-        Box.id == Row.box_id,
-        Row.id == Section.row_id,
-        Section.id == Card.id,
-        Card.tcg_id == tcg_id
-    ).all()
+def fetch_card_locations(session, tcg_ids):
+    """
+    Load every Card holding one of tcg_ids together with its box/row/section ids.
+    Runs one joined query per ORDER_QUERY_CHUNK ids instead of one per SKU.
+    Returns {tcg_id: [(box_id, row_id, section_id, card), ...]} in storage order.
+    """
+    by_tcg_id = {}
+    tcg_ids = sorted(set(tcg_ids))
 
-    total_cards_collected = 0
+    for start in range(0, len(tcg_ids), ORDER_QUERY_CHUNK):
+        chunk = tcg_ids[start:start + ORDER_QUERY_CHUNK]
+        query_result = session.query(Box.id, Row.id, Section.id, Card).filter(
+            Box.id == Row.box_id,
+            Row.id == Section.row_id,
+            Section.id == Card.section_id,
+            Card.tcg_id.in_(chunk)
+        ).order_by(Box.id, Row.id, Section.id, Card.id)
 
-    for box, row, section, sleeve, card in query_result:
-        if total_cards_collected >= needed_quantity:
-            break
+        for box_id, row_id, section_id, card in query_result:
+            by_tcg_id.setdefault(card.tcg_id, []).append((box_id, row_id, section_id, card))
 
-        location_str = f"{box.id}.{row.id}.{section.id}.{sleeve.id}"
-        
-        location_dict = next((loc for loc in locations_with_counts if loc['Location'] == location_str), None)
+    return by_tcg_id
 
-        if location_dict is None:
-            location_dict = {'Location': location_str, 'Card Count': 0}
-            locations_with_counts.append(location_dict)
+def resolve_order(session, order_lines):
+    """
+    Allocate quantities for a whole pick list against a single batched lookup.
+    order_lines is a list of (tcg_id, quantity). Repeated SKUs draw down the
+    same cards, so two lines never claim the same copies.
 
-        cards_to_collect_here = min(card.quantity, needed_quantity - total_cards_collected)
-        
-        location_dict['Card Count'] += cards_to_collect_here
-        total_cards_collected += cards_to_collect_here
+    Returns (resolved, by_location): resolved holds a (locations, cards_to_remove)
+    pair per order line, by_location maps "box.row.section" to the
+    [{'TCGplayer Id', 'Card Count'}] picks made there.
+    """
+    with metrics.timer('resolve_order.query'):
+        candidates = fetch_card_locations(session, [tcg_id for tcg_id, _ in order_lines])
+    available = {}
+    resolved = []
+    by_location = {}
+
+    for tcg_id, needed_quantity in order_lines:
+        locations_with_counts = {}
+        cards_to_remove = []
+        total_cards_collected = 0
+
+        for box_id, row_id, section_id, card in candidates.get(tcg_id, ()):
+            if total_cards_collected >= needed_quantity:
+                break
+
+            remaining = available.setdefault(card.id, card.quantity)
+            if remaining <= 0:
+                continue
+
+            cards_to_collect_here = min(remaining, needed_quantity - total_cards_collected)
+            available[card.id] = remaining - cards_to_collect_here
+            total_cards_collected += cards_to_collect_here
+
+            location_str = f"{box_id}.{row_id}.{section_id}"
+            location_dict = locations_with_counts.setdefault(
+                location_str, {'Location': location_str, 'Card Count': 0})
+            location_dict['Card Count'] += cards_to_collect_here
+
+            by_location.setdefault(location_str, []).append(
+                {'TCGplayer Id': tcg_id, 'Card Count': cards_to_collect_here})
+            cards_to_remove.append({'card': card, 'quantity_to_remove': cards_to_collect_here})
+
+        resolved.append((list(locations_with_counts.values()), cards_to_remove))
 
-        cards_to_remove.append({'card': card, 'quantity_to_remove': cards_to_collect_here})
+    return resolved, by_location
 
-    return locations_with_counts, cards_to_remove
+def find_card_location(session, tcg_id, needed_quantity):
+    with metrics.timer('find_card_location'):
+        resolved, _ = resolve_order(session, [(tcg_id, needed_quantity)])
+    return resolved[0]
 
 def remove_cards(session, cards_to_remove):
-    for card in cards_to_remove:
-        session.delete(card)
-    session.commit()
+    """
+    Apply a pick wave given as {'card': Card, 'quantity_to_remove': n} entries
+    (as built by resolve_order). Quantities are decremented with one
+    executemany UPDATE, emptied cards are deleted in chunked IN lists, and
+    each section's current_quantity and card_count are adjusted in the same
+    transaction.
+    """
+    removed = {}
+    card_sections = {}
+    for item in cards_to_remove:
+        card = item['card']
+        removed[card.id] = removed.get(card.id, 0) + item['quantity_to_remove']
+        card_sections[card.id] = card.section_id
+    if not removed:
+        return
+
+    metrics.count('mtg.remove_cards.cards', len(removed))
+    card_table, section_table = Card.__table__, Section.__table__
+    with metrics.timer('mtg.remove_cards.decrement'):
+        session.execute(
+            card_table.update().where(card_table.c.id == bindparam('_id')).values(
+                quantity=card_table.c.quantity - bindparam('_removed')),
+            [{'_id': card_id, '_removed': quantity} for card_id, quantity in removed.items()])
+
+    emptied = set()
+    card_ids = list(removed)
+    for start in range(0, len(card_ids), ORDER_QUERY_CHUNK):
+        chunk = card_ids[start:start + ORDER_QUERY_CHUNK]
+        emptied.update(session.execute(
+            select(Card.id).where(Card.id.in_(chunk), Card.quantity <= 0)).scalars())
+        session.execute(card_table.delete().where(
+            card_table.c.id.in_(chunk), card_table.c.quantity <= 0))
+
+    per_section = {}
+    for card_id, quantity in removed.items():
+        state = per_section.setdefault(card_sections[card_id], [0, 0])
+        state[0] += quantity
+        state[1] += card_id in emptied
+    session.execute(
+        section_table.update().where(section_table.c.id == bindparam('_id')).values(
+            current_quantity=section_table.c.current_quantity - bindparam('_removed'),
+            card_count=section_table.c.card_count - bindparam('_emptied')),
+        [{'_id': section_id, '_removed': quantity, '_emptied': emptied_count}
+         for section_id, (quantity, emptied_count) in per_section.items()])
+    with metrics.timer('mtg.remove_cards.commit'):
+        session.commit()
 
 
 if __name__ == "__main__":
-    engine = create_engine('sqlite:///mtg_inventory.db')
+    engine = create_inventory_engine()
     Session = sessionmaker(bind=engine)
     Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # earlier files carry this index under a name inv_manager also used
+        connection.execute(text('DROP INDEX IF EXISTS ix_sections_free_capacity'))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
     session = Session()
 
     filepath = r'/home/elmo/mtg-inv-sys/roca-test-3.csv'
@@ -0,0 +1,152 @@
+class PlacementStrategy:
+    """
+    Chooses the section a new card goes into. choose() reads a
+    FreeSpaceIndex and returns a section id, or None when nothing fits
+    (the caller opens a box and asks again); placed() is told where each
+    card actually went.
+    """
+
+    name = None
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    def choose(self, index, quantity, set_name=None):
+        raise NotImplementedError
+
+    def placed(self, section_id, set_name=None):
+        pass
+
+    def needs_history(self):
+        return False
+
+    def load_history(self, rows):
+        pass
+
+    def reset(self):
+        pass
+
+
+class EmptySectionStrategy(PlacementStrategy):
+    """
+    Every new card starts an empty section, leaving the rest of the
+    section for top-ups of the same SKU. The original allocator.
+    """
+
+    name = "empty-section"
+
+    def choose(self, index, quantity, set_name=None):
+        return index.find(self.capacity)
+
+
+class FirstFitStrategy(PlacementStrategy):
+    """
+    Lowest section id with room for the quantity.
+    """
+
+    name = "first-fit"
+
+    def choose(self, index, quantity, set_name=None):
+        return index.find(quantity)
+
+
+class BestFitStrategy(PlacementStrategy):
+    """
+    Section with the least free space that still holds the quantity.
+    """
+
+    name = "best-fit"
+
+    def choose(self, index, quantity, set_name=None):
+        return index.find_best(quantity)
+
+
+class NextFitStrategy(PlacementStrategy):
+    """
+    Keep filling the section the last card went into; when the next card
+    does not fit, move the cursor to the lowest empty section.
+    """
+
+    name = "next-fit"
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.cursor = None
+
+    def choose(self, index, quantity, set_name=None):
+        if (
+            self.cursor is not None
+            and self.cursor in index
+            and index.remaining(self.cursor) >= quantity
+        ):
+            return self.cursor
+        return index.find(self.capacity)
+
+    def placed(self, section_id, set_name=None):
+        self.cursor = section_id
+
+    def reset(self):
+        self.cursor = None
+
+
+class SameSetStrategy(PlacementStrategy):
+    """
+    Put a card next to the latest card from the same set when that section
+    has room, otherwise start an empty section for the set. Only once no
+    empty section is left are partly filled ones used, best-fit.
+    """
+
+    name = "same-set"
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.sections = None
+
+    def needs_history(self):
+        return self.sections is None
+
+    def load_history(self, rows):
+        """
+        Seed from (set_name, section_id) pairs, latest section per set.
+        """
+        self.sections = dict(rows)
+
+    def choose(self, index, quantity, set_name=None):
+        section_id = (self.sections or {}).get(set_name)
+        if (
+            section_id is not None
+            and section_id in index
+            and index.remaining(section_id) >= quantity
+        ):
+            return section_id
+        section_id = index.find(self.capacity)
+        if section_id is None:
+            section_id = index.find_best(quantity)
+        return section_id
+
+    def placed(self, section_id, set_name=None):
+        if self.sections is not None:
+            self.sections[set_name] = section_id
+
+    def reset(self):
+        self.sections = None
+
+
+PLACEMENT_STRATEGIES = {
+    strategy.name: strategy
+    for strategy in (
+        EmptySectionStrategy,
+        FirstFitStrategy,
+        BestFitStrategy,
+        NextFitStrategy,
+        SameSetStrategy,
+    )
+}
+
+
+def make_placement_strategy(name, capacity):
+    if name not in PLACEMENT_STRATEGIES:
+        raise ValueError(
+            f"Unknown placement strategy {name!r}; expected one of {sorted(PLACEMENT_STRATEGIES)}"
+        )
+    return PLACEMENT_STRATEGIES[name](capacity)
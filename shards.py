@@ -0,0 +1,407 @@
+import argparse
+import contextlib
+import hashlib
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import distinct, func, select, text
+from sqlalchemy.orm import sessionmaker
+
+from db_engine import SQLITE_PROFILES, create_inventory_engine
+from inv_manager import (
+    Base,
+    Box,
+    Card,
+    InventoryStatus,
+    Row,
+    Section,
+    allocate_picks,
+    bulk_insert_records,
+    ensure_event_log,
+    ensure_indexes,
+    ensure_rollups,
+    insert_card,
+    inventory_totals,
+    logger,
+    parse_csv_rows,
+    pick_candidates,
+    recompute_rollups,
+    remove_quantities,
+)
+from placement import PLACEMENT_STRATEGIES
+
+SHARD_DIR = "shards"
+BLOOM_CAPACITY = 100000
+BLOOM_ERROR_RATE = 0.01
+COPY_CHUNK = 10000
+
+
+class BloomFilter:
+    """
+    tcg_id membership with no false negatives and about error_rate false
+    positives while it holds at most `capacity` ids. Ids cannot be removed,
+    so SKUs that sold out keep matching until the filter is rebuilt.
+    """
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, tcg_id):
+        digest = hashlib.blake2b(
+            tcg_id.to_bytes(8, "little", signed=True), digest_size=16
+        ).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, tcg_id):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(tcg_id)
+        )
+
+    def add(self, tcg_id):
+        if tcg_id in self:
+            return
+        for position in self._positions(tcg_id):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class Shard:
+    """
+    One location's inventory database with its own warm InventoryStatus
+    and tcg_id filter. Writes hold `lock`, since they share those caches
+    and SQLite has a single writer; reads use their own sessions.
+    """
+
+    def __init__(self, location, url, profile="interactive", placement="empty-section"):
+        self.location = location
+        self.engine = create_inventory_engine(url, profile=profile)
+        self.sessionmaker = sessionmaker(bind=self.engine)
+        self.inventory_status = InventoryStatus(placement=placement, location=location)
+        self.lock = threading.Lock()
+        self.skus = None
+
+    def open(self):
+        Base.metadata.create_all(self.engine)
+        ensure_indexes(self.engine)
+        ensure_rollups(self.engine)
+        ensure_event_log(self.engine)
+        self.rebuild_filter()
+
+    def rebuild_filter(self):
+        """
+        Rebuild the tcg_id filter from the cards table, sized for twice the
+        current SKU count. Call it at open or while holding `lock`.
+        """
+        with self.sessionmaker() as session:
+            sku_count = session.execute(select(func.count(distinct(Card.tcg_id)))).scalar()
+            skus = BloomFilter(max(BLOOM_CAPACITY, 2 * sku_count))
+            for tcg_id in session.execute(
+                select(Card.tcg_id).distinct().execution_options(yield_per=COPY_CHUNK)
+            ).scalars():
+                skus.add(tcg_id)
+        self.skus = skus
+
+    def remember(self, tcg_ids):
+        for tcg_id in tcg_ids:
+            self.skus.add(tcg_id)
+        if self.skus.count > self.skus.capacity:
+            self.rebuild_filter()
+
+    def close(self):
+        self.engine.dispose()
+
+
+def shard_path(directory, location):
+    slug = re.sub(r"[^a-z0-9]+", "-", location.lower()).strip("-")
+    return os.path.join(directory, f"inventory-{slug}.db")
+
+
+class ShardRouter:
+    """
+    Inventory split by location into one SQLite file per location. Intake
+    goes to the named location's shard; picks fan out in parallel to the
+    shards whose filter may hold the order's SKUs and are allocated across
+    the merged stock.
+    """
+
+    def __init__(
+        self,
+        locations,
+        directory=SHARD_DIR,
+        profile="interactive",
+        placement="empty-section",
+        workers=None,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.shards = {
+            location: Shard(
+                location,
+                f"sqlite:///{shard_path(directory, location)}",
+                profile,
+                placement,
+            )
+            for location in locations
+        }
+        self.executor = ThreadPoolExecutor(max_workers=workers or len(self.shards))
+
+    def open(self):
+        for shard in self.shards.values():
+            shard.open()
+        return self
+
+    def close(self):
+        self.executor.shutdown()
+        for shard in self.shards.values():
+            shard.close()
+
+    def shard(self, location):
+        try:
+            return self.shards[location]
+        except KeyError:
+            raise ValueError(
+                f"Unknown location {location!r}; expected one of {sorted(self.shards)}"
+            )
+
+    def insert(self, location, tcg_id, card_name, set_name, quantity):
+        shard = self.shard(location)
+        with shard.lock, shard.sessionmaker() as session:
+            inserted = insert_card(
+                session, shard.inventory_status, tcg_id, card_name, set_name, quantity
+            )
+            if inserted:
+                shard.remember([tcg_id])
+        return inserted
+
+    def bulk_insert(self, location, records, batch_size=5000):
+        shard = self.shard(location)
+        with shard.lock, shard.sessionmaker() as session:
+            stored = bulk_insert_records(
+                session, shard.inventory_status, records, batch_size
+            )
+            shard.remember(tcg_id for tcg_id, _, _, _ in records)
+        return stored
+
+    def holders(self, tcg_ids):
+        """
+        Locations whose filter may hold any of tcg_ids, in router order.
+        """
+        return [
+            location
+            for location, shard in self.shards.items()
+            if any(tcg_id in shard.skus for tcg_id in tcg_ids)
+        ]
+
+    def _candidates(self, location, tcg_ids):
+        shard = self.shards[location]
+        wanted = [tcg_id for tcg_id in tcg_ids if tcg_id in shard.skus]
+        with shard.sessionmaker() as session:
+            return pick_candidates(session, wanted)
+
+    def locate(self, order_lines, prefer=None, holders=None):
+        """
+        Like resolve_pick_list across every location: stock at `prefer` is
+        used first, then the other locations in router order. Picks carry
+        a "Warehouse" key; their card_id is local to that warehouse. Only
+        `holders` are searched if given, otherwise the holders() of the
+        order's SKUs.
+        """
+        tcg_ids = {tcg_id for tcg_id, _ in order_lines}
+        if holders is None:
+            holders = self.holders(tcg_ids)
+        locations = sorted(holders, key=lambda location: location != prefer)
+        futures = [
+            (location, self.executor.submit(self._candidates, location, tcg_ids))
+            for location in locations
+        ]
+        merged = {}
+        for location, future in futures:
+            for tcg_id, cards in future.result().items():
+                merged.setdefault(tcg_id, []).extend(
+                    ((location, position), (location, card_id), quantity)
+                    for position, card_id, quantity in cards
+                )
+        return [
+            [
+                {
+                    "Warehouse": pick["Location"][0],
+                    "Location": pick["Location"][1],
+                    "card_id": pick["card_id"][1],
+                    "Card Count": pick["Card Count"],
+                }
+                for pick in picks
+            ]
+            for picks in allocate_picks(merged, order_lines)
+        ]
+
+    def _remove(self, location, picks):
+        shard = self.shards[location]
+        with shard.sessionmaker() as session:
+            return remove_quantities(session, shard.inventory_status, picks)
+
+    def pick(self, order_lines, prefer=None):
+        """
+        locate, then take the picks out of each warehouse in parallel. The
+        warehouses involved are locked, in name order, from lookup until
+        their removals commit. Each warehouse commits separately, so a
+        failure in one leaves the others' removals in place.
+        """
+        holders = self.holders({tcg_id for tcg_id, _ in order_lines})
+        with contextlib.ExitStack() as stack:
+            for location in sorted(holders):
+                stack.enter_context(self.shards[location].lock)
+            resolved = self.locate(order_lines, prefer, holders)
+            by_location = {}
+            for picks in resolved:
+                for pick in picks:
+                    by_location.setdefault(pick["Warehouse"], []).append(pick)
+            futures = [
+                self.executor.submit(self._remove, location, picks)
+                for location, picks in by_location.items()
+            ]
+            for future in futures:
+                future.result()
+        return resolved
+
+    def totals(self):
+        totals = {}
+        for location, shard in self.shards.items():
+            with shard.sessionmaker() as session:
+                totals[location] = {
+                    **inventory_totals(session),
+                    "filter_skus": shard.skus.count,
+                }
+        return totals
+
+
+def split_by_location(source_engine, router, default_location):
+    """
+    Copy an unsharded database into the router's (empty) shards by
+    Box.location, keeping box, row, section and card ids so printed
+    locations stay valid. Boxes without a location, and cards without a
+    section, go to default_location. Rollups and the event log are rebuilt
+    in each shard; section change history is not copied.
+    """
+    router.shard(default_location)
+    owners = {}
+    copied = {location: 0 for location in router.shards}
+    with source_engine.connect() as source:
+        for table, parent_key in (
+            (Box.__table__, None),
+            (Row.__table__, "box_id"),
+            (Section.__table__, "row_id"),
+            (Card.__table__, "section_id"),
+        ):
+            columns = {column.name for column in table.columns}
+            parents, owners = owners, {}
+            pending = {location: [] for location in router.shards}
+            result = source.execution_options(yield_per=COPY_CHUNK).execute(
+                text(f"SELECT * FROM {table.name}")
+            )
+            for record in result.mappings():
+                if parent_key is None:
+                    location = record["location"] or default_location
+                    router.shard(location)
+                else:
+                    location = parents.get(record[parent_key], default_location)
+                if table is Card.__table__:
+                    copied[location] += 1
+                else:
+                    owners[record["id"]] = location
+                values = {key: value for key, value in record.items() if key in columns}
+                if table is Box.__table__:
+                    values["location"] = location
+                pending[location].append(values)
+                if len(pending[location]) >= COPY_CHUNK:
+                    with router.shards[location].engine.begin() as connection:
+                        connection.execute(table.insert(), pending[location])
+                    pending[location] = []
+            for location, records in pending.items():
+                if records:
+                    with router.shards[location].engine.begin() as connection:
+                        connection.execute(table.insert(), records)
+
+    for shard in router.shards.values():
+        with shard.engine.begin() as connection:
+            recompute_rollups(connection)
+        ensure_event_log(shard.engine)
+        shard.inventory_status.reset_caches()
+        shard.rebuild_filter()
+    logger.info(f"Split cards by location: {copied}")
+    return copied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inventory sharded by location")
+    parser.add_argument(
+        "--locations",
+        type=lambda value: [location.strip() for location in value.split(",")],
+        required=True,
+        help="comma-separated locations, one shard each",
+    )
+    parser.add_argument("--directory", default=SHARD_DIR)
+    parser.add_argument(
+        "--profile", choices=sorted(SQLITE_PROFILES), default="interactive"
+    )
+    parser.add_argument(
+        "--placement", choices=sorted(PLACEMENT_STRATEGIES), default="empty-section"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    split_parser = commands.add_parser(
+        "split", help="copy an unsharded database into the shards by Box.location"
+    )
+    split_parser.add_argument("source", help="path of the unsharded SQLite file")
+    split_parser.add_argument("--default-location", required=True)
+    intake_parser = commands.add_parser("intake", help="upload a CSV to one location")
+    intake_parser.add_argument("location")
+    intake_parser.add_argument("filepath")
+    intake_parser.add_argument("--batch-size", type=int, default=5000)
+    pick_parser = commands.add_parser("pick", help="pick an order CSV across locations")
+    pick_parser.add_argument("filepath")
+    pick_parser.add_argument("--prefer", help="location to pick from first")
+    commands.add_parser("status", help="totals per location")
+    args = parser.parse_args()
+
+    router = ShardRouter(args.locations, args.directory, args.profile, args.placement)
+    router.open()
+    try:
+        if args.command == "split":
+            split_by_location(
+                create_inventory_engine(f"sqlite:///{args.source}"),
+                router,
+                args.default_location,
+            )
+        elif args.command == "intake":
+            router.bulk_insert(
+                args.location, parse_csv_rows(args.filepath), args.batch_size
+            )
+        elif args.command == "pick":
+            order_lines = [
+                (tcg_id, quantity)
+                for tcg_id, _, _, quantity in parse_csv_rows(args.filepath)
+            ]
+            for (tcg_id, quantity), picks in zip(
+                order_lines, router.pick(order_lines, args.prefer)
+            ):
+                for pick in picks:
+                    print(
+                        f"{tcg_id} x{pick['Card Count']}: "
+                        f"{pick['Warehouse']} {pick['Location']}"
+                    )
+                taken = sum(pick["Card Count"] for pick in picks)
+                if taken < quantity:
+                    print(f"{tcg_id}: short {quantity - taken}")
+        else:
+            for location, totals in router.totals().items():
+                print(f"{location}: {totals}")
+    finally:
+        router.close()
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from db_engine import create_inventory_engine
+from inv_manager import Base, Card, Row, Section, SectionChange, Snapshot, logger
+
+SNAPSHOT_DIR = "snapshots"
+
+
+def iter_sections(session, section_filter=None, chunk_size=1000):
+    """
+    Stream (section_id, section_dict) pairs in id order from one joined query.
+    """
+    statement = (
+        select(
+            Section.id,
+            Row.box_id,
+            Section.row_id,
+            Section.card_count,
+            Section.current_quantity,
+            Card.tcg_id,
+            Card.card_name,
+            Card.set_name,
+            Card.quantity,
+        )
+        .join(Row, Section.row_id == Row.id)
+        .outerjoin(Card, Card.section_id == Section.id)
+        .order_by(Section.id, Card.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    if section_filter is not None:
+        statement = statement.where(section_filter)
+
+    for section_id, records in groupby(session.execute(statement), key=itemgetter(0)):
+        records = list(records)
+        yield section_id, {
+            "box_id": records[0][1],
+            "row_id": records[0][2],
+            "card_count": records[0][3],
+            "current_quantity": records[0][4],
+            "cards": [
+                {
+                    "TCGplayer Id": record[5],
+                    "Product Name": record[6],
+                    "Set Name": record[7],
+                    "Add to Quantity": record[8],
+                }
+                for record in records
+                if record[5] is not None
+            ],
+        }
+
+
+def _write_snapshot_file(path, snapshot, sections):
+    with open(path, "w") as f:
+        f.write(
+            f'{{"snapshot_id": {snapshot.id}, '
+            f'"base_snapshot_id": {json.dumps(snapshot.base_snapshot_id)}, '
+            f'"last_change_id": {snapshot.last_change_id}, "sections": {{'
+        )
+        for position, (section_id, section) in enumerate(sections):
+            f.write(("," if position else "") + f'"{section_id}": {json.dumps(section)}')
+        f.write("}}")
+
+
+def _new_snapshot(session, directory, base_snapshot_id, last_change_id):
+    snapshot = Snapshot(base_snapshot_id=base_snapshot_id, last_change_id=last_change_id)
+    session.add(snapshot)
+    session.flush()
+    os.makedirs(directory, exist_ok=True)
+    snapshot.path = os.path.join(directory, f"snapshot-{snapshot.id}.json")
+    return snapshot
+
+
+def export_snapshot(session, since=None, directory=SNAPSHOT_DIR):
+    """
+    Write a snapshot file and record it. With `since`, only sections logged
+    in section_changes after that snapshot are exported (a delta);
+    otherwise every section is (a full snapshot).
+    """
+    last_change_id = session.query(func.max(SectionChange.id)).scalar() or 0
+
+    section_filter = None
+    if since is not None:
+        base = session.get(Snapshot, since)
+        if base is None:
+            raise ValueError(f"Snapshot {since} not found")
+        section_filter = Section.id.in_(
+            select(SectionChange.section_id).where(
+                SectionChange.id > base.last_change_id,
+                SectionChange.id <= last_change_id,
+            )
+        )
+
+    snapshot = _new_snapshot(session, directory, since, last_change_id)
+    _write_snapshot_file(snapshot.path, snapshot, iter_sections(session, section_filter))
+    session.commit()
+    logger.info(f"Wrote snapshot {snapshot.id} to {snapshot.path}")
+    return snapshot
+
+
+def load_snapshot_chain(session, snapshot_id):
+    """
+    Snapshots from the nearest full snapshot up to snapshot_id, oldest first.
+    """
+    chain = []
+    snapshot = session.get(Snapshot, snapshot_id)
+    if snapshot is None:
+        raise ValueError(f"Snapshot {snapshot_id} not found")
+    while snapshot is not None:
+        chain.append(snapshot)
+        if snapshot.base_snapshot_id is None:
+            break
+        snapshot = session.get(Snapshot, snapshot.base_snapshot_id)
+    chain.reverse()
+    if chain[0].base_snapshot_id is not None:
+        raise ValueError(f"Snapshot {snapshot_id} has no full snapshot at its base")
+    return chain
+
+
+def compact_snapshots(session, snapshot_id, directory=SNAPSHOT_DIR):
+    """
+    Merge snapshot_id and the deltas beneath it into a new full snapshot
+    holding the same state, so later deltas can be based on it directly.
+    """
+    chain = load_snapshot_chain(session, snapshot_id)
+    sections = {}
+    for snapshot in chain:
+        with open(snapshot.path) as f:
+            sections.update(json.load(f)["sections"])
+
+    snapshot = _new_snapshot(session, directory, None, chain[-1].last_change_id)
+    _write_snapshot_file(
+        snapshot.path,
+        snapshot,
+        sorted(sections.items(), key=lambda item: int(item[0])),
+    )
+    session.commit()
+    logger.info(
+        f"Compacted {len(chain)} snapshots into snapshot {snapshot.id} at {snapshot.path}"
+    )
+    return snapshot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full and delta inventory snapshots")
+    parser.add_argument("--directory", default=SNAPSHOT_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write a full or delta snapshot")
+    export_parser.add_argument(
+        "--since", type=int, help="export only sections changed since this snapshot id"
+    )
+    compact_parser = commands.add_parser(
+        "compact", help="merge a delta chain into a full snapshot"
+    )
+    compact_parser.add_argument("snapshot_id", type=int)
+    args = parser.parse_args()
+
+    engine = create_inventory_engine()
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    if args.command == "export":
+        export_snapshot(session, args.since, args.directory)
+    else:
+        compact_snapshots(session, args.snapshot_id, args.directory)
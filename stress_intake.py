@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import sessionmaker
+
+import inv_manager
+from db_engine import create_inventory_engine
+from events import verify_replay
+from inv_manager import (
+    Base,
+    Box,
+    Card,
+    InventoryStatus,
+    Row,
+    Section,
+    bulk_insert_records,
+    insert_card,
+    inventory_totals,
+)
+
+
+def _station(url, station, cards, skus, bulk, start_event):
+    """
+    One intake bench: its own engine, session and in-memory caches, all
+    racing the other stations for the same sections.
+    """
+    inv_manager.logger.setLevel("ERROR")
+    engine = create_inventory_engine(url)
+    session = sessionmaker(bind=engine)()
+    inventory_status = InventoryStatus()
+    rng = random.Random(station)
+    records = [
+        (rng.randint(1, skus), f"Card {station}", "Stress", rng.randint(1, 4))
+        for _ in range(cards)
+    ]
+
+    start_event.wait()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if bulk:
+            for start in range(0, len(records), 100):
+                bulk_insert_records(
+                    session, inventory_status, records[start : start + 100], batch_size=100
+                )
+        else:
+            for record in records:
+                insert_card(session, inventory_status, *record)
+    session.close()
+    engine.dispose()
+
+
+def check_capacity(session):
+    """
+    Return a list of problems: sections whose card_count disagrees with
+    their cards or exceeds max_cards, cards over capacity, row, box or
+    inventory free_capacity rollups that disagree with their sections, and
+    cards that replaying the event log does not reproduce.
+    """
+    problems = []
+    actual = dict(
+        session.execute(
+            select(Card.section_id, func.sum(Card.quantity)).group_by(Card.section_id)
+        ).all()
+    )
+    for section_id, card_count, max_cards in session.execute(
+        select(Section.id, Section.card_count, Section.max_cards)
+    ):
+        if card_count > max_cards:
+            problems.append(f"section {section_id} overfilled: {card_count}/{max_cards}")
+        if card_count != actual.get(section_id, 0):
+            problems.append(
+                f"section {section_id} card_count {card_count} != cards {actual.get(section_id, 0)}"
+            )
+    over = session.execute(
+        select(func.count()).select_from(Card).where(Card.quantity > Card.capacity)
+    ).scalar()
+    if over:
+        problems.append(f"{over} cards above capacity")
+
+    section_free = func.sum(Section.max_cards - Section.card_count)
+    row_free = dict(
+        session.execute(select(Section.row_id, section_free).group_by(Section.row_id)).all()
+    )
+    for row_id, free_capacity in session.execute(select(Row.id, Row.free_capacity)):
+        if free_capacity != row_free.get(row_id, 0):
+            problems.append(
+                f"row {row_id} free_capacity {free_capacity} != sections {row_free.get(row_id, 0)}"
+            )
+    box_free = dict(
+        session.execute(
+            select(Row.box_id, section_free)
+            .join(Section, Section.row_id == Row.id)
+            .group_by(Row.box_id)
+        ).all()
+    )
+    for box_id, free_capacity in session.execute(select(Box.id, Box.free_capacity)):
+        if free_capacity != box_free.get(box_id, 0):
+            problems.append(
+                f"box {box_id} free_capacity {free_capacity} != sections {box_free.get(box_id, 0)}"
+            )
+    totals = inventory_totals(session)
+    expected = sum(box_free.values())
+    if totals["free_capacity"] != expected:
+        problems.append(f"inventory free_capacity {totals['free_capacity']} != {expected}")
+    if totals["quantity"] != sum(actual.values()):
+        problems.append(f"inventory quantity {totals['quantity']} != cards {sum(actual.values())}")
+    mismatched = verify_replay(session)
+    if mismatched:
+        problems.append(f"{len(mismatched)} cards differ from the event log")
+    return problems
+
+
+def run_stress(stations, cards, skus, bulk, directory):
+    path = os.path.join(directory, f"stress-{stations}.db")
+    url = f"sqlite:///{path}"
+    engine = create_inventory_engine(url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    start_event = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(
+            target=_station, args=(url, station, cards, skus, bulk, start_event)
+        )
+        for station in range(stations)
+    ]
+    for process in processes:
+        process.start()
+    started = time.perf_counter()
+    start_event.set()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    engine = create_inventory_engine(url)
+    session = sessionmaker(bind=engine)()
+    problems = check_capacity(session)
+    boxes = session.execute(text("SELECT COUNT(*) FROM boxes")).scalar()
+    session.close()
+    engine.dispose()
+    failed = [process.exitcode for process in processes if process.exitcode]
+    return stations * cards / elapsed, boxes, problems, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Race several intake processes against one database and check capacity counters"
+    )
+    parser.add_argument("--stations", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--cards", type=int, default=500, help="insert calls per station")
+    parser.add_argument("--skus", type=int, default=200)
+    parser.add_argument("--bulk", action="store_true", help="stations use bulk_insert_records")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for stations in args.stations:
+            rate, boxes, problems, failed = run_stress(
+                stations, args.cards, args.skus, args.bulk, directory
+            )
+            status = "ok" if not problems and not failed else "FAILED"
+            print(f"{stations} stations: {rate:.0f} cards/sec, {boxes} boxes, {status}")
+            for problem in problems[:10]:
+                print(f"    {problem}")
+            if failed:
+                print(f"    station exit codes: {failed}")
@@ -0,0 +1,131 @@
+import argparse
+import csv
+import itertools
+import random
+
+TCGPLAYER_HEADER = [
+    "TCGplayer Id",
+    "Product Line",
+    "Set Name",
+    "Product Name",
+    "Title",
+    "Number",
+    "Rarity",
+    "Condition",
+    "TCG Market Price",
+    "TCG Direct Low",
+    "TCG Low Price",
+    "Pending Quantity",
+    "Total Quantity",
+    "Add to Quantity",
+    "TCG Marketplace Price",
+    "My Store Reserve Quantity",
+    "My Store Price",
+    "Photo URL",
+    "Rs",
+    "Rc",
+    "Value",
+    "Card ID",
+]
+
+SET_NAMES = [
+    "Commander Masters",
+    "Commander Legends: Battle for Baldur's Gate",
+    "The Lord of the Rings: Tales of Middle-earth",
+    "Wilds of Eldraine",
+    "March of the Machine",
+    "Dominaria United",
+    "The Brothers' War",
+    "Phyrexia: All Will Be One",
+]
+RARITIES = ["C", "U", "R", "M"]
+QUANTITIES = [1, 2, 3, 4, 5, 8, 12, 15]
+QUANTITY_WEIGHTS = [40, 25, 12, 8, 6, 4, 3, 2]
+FIRST_TCG_ID = 5000000
+SAMPLE_CHUNK = 10000
+
+
+def sku_row(rank, quantity, rng):
+    """
+    One export row for the SKU of the given popularity rank. Everything but
+    the quantity and Card ID is derived from the rank, so a SKU always
+    carries the same name, set and price.
+    """
+    price = round(0.1 + (rank * 37 % 5000) / 100, 2)
+    return [
+        FIRST_TCG_ID + rank * 7,
+        "Magic",
+        SET_NAMES[rank % len(SET_NAMES)],
+        f"Synthetic Card {rank}",
+        "",
+        rank % 400 + 1,
+        RARITIES[rank % len(RARITIES)],
+        "Near Mint",
+        price,
+        0,
+        0,
+        0,
+        "",
+        quantity,
+        price,
+        "",
+        "",
+        "",
+        round(rng.random(), 12),
+        round(rng.random(), 12),
+        "('1',)",
+        f"{rng.getrandbits(128):032x}",
+    ]
+
+
+def synthetic_rows(rows, skus=None, skew=1.1, seed=0, invalid_rate=0.005):
+    """
+    Yield `rows` TCGplayer export rows (lists in TCGPLAYER_HEADER order).
+    SKUs are drawn from a catalogue of `skus` (default rows // 4) with
+    Zipf-like popularity 1 / rank ** skew, so skew=0 is uniform and larger
+    values concentrate intake on fewer SKUs. About invalid_rate of the
+    rows carry an "Unavailable" id or a blank quantity, as real exports do.
+    """
+    rng = random.Random(seed)
+    skus = skus or max(rows // 4, 1)
+    cum_weights = list(
+        itertools.accumulate(1 / rank**skew for rank in range(1, skus + 1))
+    )
+    ranks = range(skus)
+    for start in range(0, rows, SAMPLE_CHUNK):
+        count = min(SAMPLE_CHUNK, rows - start)
+        picked = rng.choices(ranks, cum_weights=cum_weights, k=count)
+        quantities = rng.choices(QUANTITIES, weights=QUANTITY_WEIGHTS, k=count)
+        for rank, quantity in zip(picked, quantities):
+            row = sku_row(rank, quantity, rng)
+            if invalid_rate and rng.random() < invalid_rate:
+                if rng.random() < 0.5:
+                    row[0] = "Unavailable"
+                else:
+                    row[13] = ""
+            yield row
+
+
+def write_synthetic_csv(path, rows, skus=None, skew=1.1, seed=0, invalid_rate=0.005):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(TCGPLAYER_HEADER)
+        writer.writerows(synthetic_rows(rows, skus, skew, seed, invalid_rate))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic TCGplayer export with skewed SKU popularity"
+    )
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--skus", type=int, default=None, help="catalogue size (default rows/4)")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent; 0 is uniform")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--invalid-rate", type=float, default=0.005)
+    args = parser.parse_args()
+
+    write_synthetic_csv(
+        args.path, args.rows, args.skus, args.skew, args.seed, args.invalid_rate
+    )